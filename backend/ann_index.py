@@ -0,0 +1,78 @@
+import math
+import os
+
+import faiss
+import numpy as np
+
+# Index layout, overridable from .env. "flat" is exact search; the others are approximate.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 picks ~4*sqrt(n)
+PQ_M = int(os.getenv("PQ_M", "48"))
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+
+# Search-time knobs, applied when the index is loaded
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# FAISS warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_settings(index_type: str = INDEX_TYPE) -> dict:
+    settings = {"type": index_type}
+    if index_type in ("ivf", "ivfpq"):
+        settings["nlist"] = IVF_NLIST
+    if index_type == "ivfpq":
+        settings.update(pq_m=PQ_M, pq_nbits=PQ_NBITS)
+    if index_type == "hnsw":
+        settings.update(hnsw_m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+    return settings
+
+
+def choose_nlist(num_vectors: int, requested: int = 0) -> int:
+    nlist = requested or int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def build_ann_index(vectors: np.ndarray, settings: dict) -> faiss.Index:
+    """Create, train and fill an index of the configured type over the given vectors."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    num_vectors, dim = vectors.shape
+    index_type = settings["type"]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown INDEX_TYPE '{index_type}', expected one of {INDEX_TYPES}")
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings["hnsw_m"])
+        index.hnsw.efConstruction = settings["ef_construction"]
+    elif index_type == "ivfpq" and num_vectors >= MIN_POINTS_PER_CENTROID * 2 ** settings["pq_nbits"] and dim % settings["pq_m"] == 0:
+        nlist = choose_nlist(num_vectors, settings["nlist"])
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, settings["pq_m"], settings["pq_nbits"])
+    elif index_type in ("ivf", "ivfpq") and num_vectors >= MIN_POINTS_PER_CENTROID:
+        # Not enough points to train PQ codebooks yet, so keep full vectors in the lists
+        nlist = choose_nlist(num_vectors, settings["nlist"])
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+    else:
+        # Too few vectors to train centroids/codebooks; exact search is cheap at this size anyway
+        index = faiss.IndexFlatL2(dim)
+
+    if not index.is_trained:
+        index.train(vectors)
+    if num_vectors:
+        index.add(vectors)
+    return index
+
+
+def configure_search(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH) -> faiss.Index:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+        return index
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        hnsw_index.hnsw.efSearch = ef_search
+    return index
@@ -0,0 +1,101 @@
+"""
+Parity check and throughput benchmark of the embedding backends.
+
+Every backend encodes the same sample of chunk texts. Cosine similarity is measured
+against the torch model, and the script exits non-zero if any backend falls below
+--min-cosine. It then times single-query encoding, as retrieval does, and bulk
+encoding, as ingestion does.
+
+    python bench_embeddings.py                               # chunks from the current index build
+    python bench_embeddings.py --backends torch onnx-int8 --docs 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from embedding_backend import EMBEDDING_BACKENDS, load_sentence_model
+from corpus_index import DOCUMENTS_FILE, current_build_dir
+
+SAMPLE_WORDS = (
+    "budget savings interest compound credit score loan mortgage APR Roth IRA 401k index fund "
+    "emergency fund debt payoff inflation taxes dividend portfolio retirement income expenses"
+).split()
+
+
+def load_texts(args) -> list:
+    build_dir = current_build_dir(args.index_dir)
+    if build_dir is not None:
+        from doc_store import DocumentStore
+
+        store = DocumentStore(os.path.join(build_dir, DOCUMENTS_FILE))
+        rng = np.random.default_rng(0)
+        ids = rng.choice(len(store), min(args.docs, len(store)), replace=False)
+        return [store[int(i)] for i in ids]
+    print(f"No index build in {args.index_dir}; using synthetic texts")
+    rng = np.random.default_rng(0)
+    return [" ".join(rng.choice(SAMPLE_WORDS, rng.integers(20, 150))) for _ in range(args.docs)]
+
+
+def resident_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def main():
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", os.path.join(current_directory, "index_cache")))
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--docs", type=int, default=1000, help="texts used for parity and bulk throughput")
+    parser.add_argument("--queries", type=int, default=200, help="single-text encode calls to time")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="fail if any text's mean cosine to torch is lower")
+    args = parser.parse_args()
+
+    texts = load_texts(args)
+    queries = [" ".join(text.split()[:12]) for text in texts[:args.queries]]
+    print(f"{len(texts)} texts, {len(queries)} queries, model {args.model}")
+
+    backends = list(dict.fromkeys(["torch"] + args.backends))
+    reference = None
+    failed = False
+    print(f"{'backend':<12}{'load MB':>9}{'cos mean':>10}{'cos min':>9}{'q p50 ms':>10}{'q p95 ms':>10}{'bulk/s':>9}")
+    for backend in backends:
+        before = resident_mb()
+        model = load_sentence_model(args.model, backend)
+        loaded_mb = resident_mb() - before
+        model.encode(texts[:args.batch_size], batch_size=args.batch_size)
+
+        start = time.perf_counter()
+        vectors = np.asarray(model.encode(texts, batch_size=args.batch_size, normalize_embeddings=True), dtype="float32")
+        bulk_rate = len(texts) / (time.perf_counter() - start)
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            model.encode([query])
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+
+        if reference is None:
+            reference = vectors
+        cosines = np.sum(vectors * reference, axis=1)
+        if backend != "torch" and cosines.mean() < args.min_cosine:
+            failed = True
+        print(
+            f"{backend:<12}{loaded_mb:>9.0f}{cosines.mean():>10.4f}{cosines.min():>9.4f}"
+            f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}{bulk_rate:>9.0f}"
+        )
+        del model
+
+    if failed:
+        print(f"Parity check failed: mean cosine to torch below {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Offline stand-ins for Gemini, Firestore latency and the embedding model, used by bench_suite.py."""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Iterator, List, Union
+
+import numpy as np
+
+LOREM = (
+    "A budget is a plan for every dollar you earn. Paying yourself first means moving money into "
+    "savings before spending. Compound interest grows savings over time because interest earns "
+    "interest. Keeping credit card balances low helps your credit score. An emergency fund covers "
+    "three to six months of expenses so surprises do not turn into debt."
+).split()
+
+
+class Latency:
+    """
+    Latency distribution parsed from a spec string:
+
+        0 / none               no delay
+        fixed:S                always S seconds
+        uniform:LOW:HIGH       uniform between LOW and HIGH seconds
+        lognormal:MEDIAN:SIGMA long-tailed, like real API calls
+    """
+
+    def __init__(self, spec: str = "0", seed: int = 0):
+        self.spec = spec
+        parts = spec.split(":")
+        self.kind = parts[0].lower()
+        self.params = [float(p) for p in parts[1:]]
+        expected = {"0": 0, "none": 0, "fixed": 1, "uniform": 2, "lognormal": 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError(f"Invalid latency spec {spec!r}; see Latency docstring")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.params)
+            if self.kind == "lognormal":
+                median, sigma = self.params
+                return self._rng.lognormvariate(np.log(median), sigma) if median > 0 else 0.0
+            return 0.0
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """
+    Mimics genai.GenerativeModel.generate_content for the prompts the backend sends:
+    question-bank prompts get a JSON array of valid questions, subtopic prompts a JSON
+    array (or a numbered list if the prompt doesn't ask for JSON), everything else a
+    paragraph of text. Streaming spreads the total
+    latency over the chunks, with the first chunk taking `first_chunk_share` of it.
+    """
+
+    def __init__(self, latency: Latency, words: int = 200, stream_chunks: int = 20, first_chunk_share: float = 0.4):
+        self.latency = latency
+        self.words = words
+        self.stream_chunks = stream_chunks
+        self.first_chunk_share = first_chunk_share
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _next_id(self) -> int:
+        with self._lock:
+            self._counter += 1
+            self.calls += 1
+            return self._counter
+
+    def _reply(self, prompt: str) -> str:
+        call = self._next_id()
+        if '"correct"' in prompt:
+            match = re.search(r"Create (\d+) multiple-choice", prompt)
+            count = int(match.group(1)) if match else 5
+            return json.dumps([
+                {
+                    "question": f"Benchmark question {call}-{i}: which choice grows savings fastest?",
+                    "options": [f"Option {call}-{i}-{letter}" for letter in "ABCD"],
+                    "correct": i % 4,
+                }
+                for i in range(count)
+            ])
+        if "subtopics" in prompt:
+            match = re.search(r"(\d+) (?:more )?subtopics", prompt)
+            subtopics = [f"Subtopic {call}-{i} of the lesson" for i in range(1, int(match.group(1)) + 1 if match else 11)]
+            if "JSON" in prompt:
+                return json.dumps(subtopics)
+            return "\n".join(f"{i}. {subtopic}" for i, subtopic in enumerate(subtopics, start=1))
+        return " ".join(LOREM[i % len(LOREM)] for i in range(self.words))
+
+    def generate_content(self, prompt: str, stream: bool = False, generation_config=None, request_options=None) -> Union[_Response, Iterator[_Response]]:
+        if stream:
+            return self._stream(prompt)
+        time.sleep(self.latency())
+        return _Response(self._reply(prompt))
+
+    def _stream(self, prompt: str) -> Iterator[_Response]:
+        total = self.latency()
+        text = self._reply(prompt)
+        words = text.split(" ")
+        size = max(1, len(words) // self.stream_chunks)
+        chunks = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        time.sleep(total * self.first_chunk_share)
+        rest = total * (1 - self.first_chunk_share) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(rest)
+            yield _Response(chunk)
+
+
+class FakeEncoder:
+    """
+    Deterministic hashed bag-of-words embeddings with the encode() interface of
+    SentenceTransformer. Texts sharing words get similar vectors, which is enough to
+    exercise indexing, caching and retrieval without downloading a model.
+    """
+
+    tokenizer = None
+
+    def __init__(self, dim: int = 384, latency: Latency = None):
+        self.dim = dim
+        self.latency = latency or Latency("0")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences: Union[str, List[str]], normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        time.sleep(self.latency())
+        vectors = np.stack([self._embed(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        return vectors[0] if single else vectors
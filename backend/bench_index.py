@@ -0,0 +1,90 @@
+"""
+Recall-vs-latency benchmark of each index type against exact flat search.
+
+    python bench_index.py                      # embeddings from the current index build
+    python bench_index.py --synthetic 1000000  # clustered random vectors
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import INDEX_TYPES, build_ann_index, configure_search, index_settings
+from corpus_index import EMBEDDINGS_FILE, current_build_dir
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        # Clustered data behaves more like real embeddings than uniform noise
+        centers = rng.standard_normal((max(1, args.synthetic // 1000), args.dim)).astype("float32")
+        vectors = centers[rng.integers(0, len(centers), args.synthetic)]
+        vectors += 0.3 * rng.standard_normal(vectors.shape).astype("float32")
+    else:
+        build_dir = current_build_dir(args.index_dir)
+        if build_dir is None:
+            raise SystemExit(f"No index build in {args.index_dir}; run corpus_index.py or pass --synthetic N")
+        vectors = np.load(os.path.join(build_dir, EMBEDDINGS_FILE))
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray):
+    latencies = []
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found[i] = ids[0]
+    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+    latencies = np.array(latencies) * 1000
+    return recall, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", os.path.join(current_directory, "index_cache")))
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N random clustered vectors instead")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 32, 64, 128])
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype("float32")
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    flat = build_ann_index(vectors, index_settings("flat"))
+    _, truth = flat.search(queries, args.k)
+
+    print(f"{'index':<22}{'build s':>9}{'MB':>9}{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    for index_type in args.types:
+        start = time.perf_counter()
+        index = build_ann_index(vectors, index_settings(index_type))
+        build_seconds = time.perf_counter() - start
+        megabytes = faiss.serialize_index(index).nbytes / 1e6
+
+        if index_type in ("ivf", "ivfpq") and faiss.try_extract_index_ivf(index) is not None:
+            sweep = [(f"{index_type} nprobe={n}", dict(nprobe=n)) for n in args.nprobe]
+        elif index_type == "hnsw":
+            sweep = [(f"hnsw ef={ef}", dict(ef_search=ef)) for ef in args.ef_search]
+        else:
+            sweep = [(index_type, {})]
+        for label, params in sweep:
+            configure_search(index, **params)
+            recall, p50, p95 = measure(index, queries, args.k, truth)
+            print(f"{label:<22}{build_seconds:>9.2f}{megabytes:>9.1f}{recall:>9.3f}{p50:>9.3f}{p95:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
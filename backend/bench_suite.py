@@ -0,0 +1,298 @@
+"""
+Benchmark suite: microbenchmarks for ingestion, embedding and index search, then
+concurrent load scenarios against the API served in-process. Gemini and Firestore are
+replaced by offline fakes with configurable latency distributions (see bench_fakes.py),
+so runs are reproducible and need no network.
+
+    python bench_suite.py --fake-embeddings                      # fully offline
+    python bench_suite.py --scenarios chat recommend --concurrency 32 --requests 500
+    python bench_suite.py --llm-latency lognormal:1.2:0.5 --db-latency fixed:0.03
+
+Each run is saved to bench_results/<time>-<commit>.json and compared with the previous one.
+"""
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from bench_fakes import FakeEncoder, FakeGenerativeModel, Latency
+
+TOPICS = ["budgeting", "credit scores", "compound interest", "index funds", "emergency funds", "student loans", "Roth IRA", "taxes"]
+QUESTIONS = [
+    "How do I start an emergency fund?",
+    "What is a good credit score?",
+    "Should I pay off debt or invest first?",
+    "How does compound interest work?",
+    "What is the difference between a Roth IRA and a 401k?",
+    "How much of my income should I save?",
+]
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    if not seconds:
+        return {"count": 0}
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def time_calls(func: Callable[[int], object], n: int) -> List[float]:
+    latencies = []
+    for i in range(n):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def configure(main, args):
+    from user_store import MemoryUserBackend, UserStore
+
+    main.gemini.set(FakeGenerativeModel(Latency(args.llm_latency, seed=1)))
+    main.user_store.set(UserStore(MemoryUserBackend(latency=Latency(args.db_latency, seed=2))))
+    main.RESPONSE_CACHE_ENABLED = args.response_cache
+    main.DATA_DIR = args.data_dir
+    main.QUESTION_BANK_PATH = os.path.join(tempfile.mkdtemp(prefix="bench-"), "question_bank.sqlite3")
+    if args.fake_embeddings:
+        # Fake vectors must never mix with an index built from the real model
+        main.sentence_model.set(FakeEncoder())
+        main.EMBEDDING_MODEL = "fake-hashed-bow-384"
+        main.INDEX_DIR = args.index_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results", "index_cache")
+    elif args.index_dir:
+        main.INDEX_DIR = args.index_dir
+
+
+def run_micro(main, args) -> Dict[str, dict]:
+    from ingest import create_extraction_pool, ingest_file
+
+    results = {}
+    model = main.sentence_model.get()
+    corpus = main.corpus.get()
+    texts = [corpus.text(i) for i in range(min(args.bulk_texts, corpus.size))]
+    queries = [QUESTIONS[i % len(QUESTIONS)] + f" {TOPICS[i % len(TOPICS)]}" for i in range(args.micro_queries)]
+
+    results["embed_query"] = summarize(time_calls(lambda i: model.encode([queries[i]]), len(queries)))
+    start = time.perf_counter()
+    model.encode(texts, batch_size=32)
+    results["embed_bulk"] = {"texts": len(texts), "texts_per_s": round(len(texts) / (time.perf_counter() - start), 1)}
+
+    vectors = np.asarray(model.encode(queries), dtype="float32")
+    results["index_search"] = summarize(time_calls(lambda i: corpus.search(vectors[i:i + 1], 10), len(queries)))
+    batch = vectors[:32]
+    batch_latencies = time_calls(lambda i: corpus.search(batch, 10), max(1, len(queries) // 10))
+    results["index_search_batch32"] = summarize(batch_latencies)
+    results["lexical_search"] = summarize(time_calls(lambda i: corpus.lexical_search(queries[i], 50), len(queries)))
+    results["retrieve_hybrid"] = summarize(time_calls(lambda i: main.retrieve_relevant_content(queries[i], 10), len(queries)))
+
+    from context_builder import ContextBuilder, context_budget
+    from instrumentation import estimate_tokens
+
+    retrieved = [main.retrieve_relevant_content(query, 10) for query in queries]
+    # Stand-ins for the stored chunk embeddings the routes pass in, computed outside the timing
+    retrieved_vectors = [np.asarray(model.encode(chunks), dtype="float32") for chunks in retrieved]
+    builder = ContextBuilder(model.encode)
+    contexts = []
+    results["context_build"] = summarize(time_calls(
+        lambda i: contexts.append(builder.build(vectors[i], retrieved[i], context_budget("chat"), retrieved_vectors[i])), len(queries)
+    ))
+    results["context_tokens"] = {
+        "retrieved": int(np.mean([sum(estimate_tokens(chunk) for chunk in chunks) for chunks in retrieved])),
+        "budgeted": int(np.mean([estimate_tokens(context) for context in contexts])),
+    }
+
+    pdfs = sorted(glob.glob(os.path.join(args.data_dir, "*.pdf")), key=os.path.getsize)
+    if pdfs:
+        path = pdfs[0]
+        pool = create_extraction_pool() if args.ingest_workers > 1 else None
+        try:
+            start = time.perf_counter()
+            chunks, _, _ = ingest_file(path, os.path.basename(path), model, pool)
+            seconds = time.perf_counter() - start
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        results["ingest_file"] = {
+            "file": os.path.basename(path),
+            "mb": round(os.path.getsize(path) / 1e6, 2),
+            "seconds": round(seconds, 3),
+            "chunks_per_s": round(len(chunks) / seconds, 1),
+        }
+    return results
+
+
+def scenarios(context: dict) -> Dict[str, tuple]:
+    # name -> (method, path factory, payload factory); factories take the request number
+    users = context["users"]
+    return {
+        "login": ("POST", lambda i: "/api/login", lambda i: {"username": f"bench{i}", "password": "secret"}),
+        "get_age": ("GET", lambda i: f"/api/get-age/{users[i % len(users)]}", lambda i: None),
+        "store_topic": ("POST", lambda i: "/api/store-topic", lambda i: {"userId": users[i % len(users)], "topic": TOPICS[i % len(TOPICS)]}),
+        "recommend": ("POST", lambda i: "/recommend", lambda i: {
+            "age": 16 + (i * 7) % 50, "credit_score": 550 + (i * 37) % 300, "country": "United States",
+            "occupation": ["student", "teacher", "small business owner", "nurse"][i % 4],
+            "monthly_income": 1500 + (i * 311) % 8000, "monthly_expenses": 1200 + (i * 173) % 5000,
+        }),
+        "chat": ("POST", lambda i: "/chat", lambda i: {"question": f"{QUESTIONS[i % len(QUESTIONS)]} ({i})", "k": 5}),
+        "chat_stream": ("POST", lambda i: "/chat/stream", lambda i: {"question": f"{QUESTIONS[i % len(QUESTIONS)]} ({i})", "k": 5}),
+        "subtopics": ("POST", lambda i: "/generate_subtopics", lambda i: {"topic": TOPICS[i % len(TOPICS)], "age": 14 + i % 30}),
+        "lesson": ("POST", lambda i: "/generate_lesson", lambda i: {"topic": TOPICS[i % len(TOPICS)], "age": 14 + i % 30}),
+        "quiz": ("POST", lambda i: "/generate_quiz", lambda i: {
+            "topic": TOPICS[i % len(TOPICS)], "difficulty": i % 10, "num_questions": 5, "userId": users[i % len(users)],
+        }),
+        "game": ("POST", lambda i: "/generate_game", lambda i: {"level": i % 10, "num_questions": 5, "userId": users[i % len(users)]}),
+    }
+
+
+async def run_scenario(client, method: str, path: Callable, payload: Callable, concurrency: int, total: int) -> dict:
+    latencies, errors = [], []
+    counter = itertools.count()
+
+    async def worker():
+        while (i := next(counter)) < total:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path(i), json=payload(i))
+                if response.status_code >= 400:
+                    errors.append(f"{response.status_code}: {response.text[:200]}")
+                    continue
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    result = summarize(latencies)
+    result.update({"errors": len(errors), "throughput_rps": round(len(latencies) / wall, 2), "concurrency": concurrency})
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+async def run_load(main, args) -> Dict[str, dict]:
+    import httpx
+
+    for resource in (main.corpus, main.retriever, main.recommender, main.question_bank):
+        await resource.aget()
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        users = []
+        for i in range(20):
+            response = await client.post("/api/login", json={"username": f"seed{i}", "password": "secret"})
+            users.append(response.json()["documentId"])
+            await client.post(f"/api/complete-profile-info/{users[-1]}", json={
+                "fullName": f"Seed {i}", "age": 18 + i, "dateOfBirth": "2000-01-01", "occupation": "student",
+                "country": "United States", "sourceOfIncome": "part-time job", "isCreditCardHolder": False,
+                "creditScore": 650, "monthlyIncome": 2000, "monthlyExpenses": 1500, "financialGoals": "save",
+            })
+        table = scenarios({"users": users})
+        for name in args.scenarios:
+            method, path, payload = table[name]
+            result = await run_scenario(client, method, path, payload, args.concurrency, args.requests)
+            results[name] = result
+            print(f"  {name:<14}{result.get('p50_ms', 0):>10.1f}{result.get('p95_ms', 0):>10.1f}"
+                  f"{result.get('p99_ms', 0):>10.1f}{result['throughput_rps']:>10.1f}{result['errors']:>8}")
+    return results
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous: dict, current: dict):
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    changed = sorted(k for k in current["config"] if previous.get("config", {}).get(k) != current["config"][k])
+    if changed:
+        print(f"  note: settings differ ({', '.join(changed)})")
+    for section in ("micro", "load"):
+        for name, result in current.get(section, {}).items():
+            old = previous.get(section, {}).get(name)
+            if not old:
+                continue
+            for metric in ("p95_ms", "throughput_rps", "texts_per_s", "chunks_per_s"):
+                if metric in result and old.get(metric):
+                    change = (result[metric] - old[metric]) / old[metric] * 100
+                    label = f"{section}.{name}.{metric}"
+                    print(f"  {label:<40}{old[metric]:>12.2f} -> {result[metric]:>10.2f} ({change:+.1f}%)")
+
+
+def main():
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    all_scenarios = list(scenarios({"users": [""]}))
+    parser.add_argument("--scenarios", nargs="+", default=all_scenarios, choices=all_scenarios)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--llm-latency", default="lognormal:0.8:0.4", help="fake Gemini latency spec, see bench_fakes.Latency")
+    parser.add_argument("--db-latency", default="lognormal:0.03:0.3", help="fake Firestore round-trip latency spec")
+    parser.add_argument("--fake-embeddings", action="store_true", help="hashed bag-of-words vectors instead of the real model")
+    parser.add_argument("--response-cache", action="store_true", help="keep the LLM response cache on (off by default)")
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", os.path.join(current_directory, "data")))
+    parser.add_argument("--index-dir", default=None)
+    parser.add_argument("--micro-queries", type=int, default=200)
+    parser.add_argument("--bulk-texts", type=int, default=1000)
+    parser.add_argument("--ingest-workers", type=int, default=2, help="1 runs ingestion in-process")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--results-dir", default=os.path.join(current_directory, "bench_results"))
+    args = parser.parse_args()
+
+    import main as app_module
+
+    configure(app_module, args)
+    started = time.perf_counter()
+    app_module.corpus.get()
+    print(f"Corpus ready in {time.perf_counter() - started:.1f}s ({app_module.corpus.get().size} chunks)")
+
+    run = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "results_dir"},
+    }
+    try:
+        if not args.skip_micro:
+            run["micro"] = run_micro(app_module, args)
+            for name, result in run["micro"].items():
+                print(f"  {name:<22}{json.dumps(result)}")
+        if not args.skip_load:
+            print(f"  {'scenario':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}")
+            run["load"] = asyncio.run(run_load(app_module, args))
+    finally:
+        app_module.shutdown_executors(wait=False)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    previous = sorted(glob.glob(os.path.join(args.results_dir, "*.json")))
+    path = os.path.join(args.results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{run['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved {path}")
+    if previous:
+        with open(previous[-1]) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Parity check of the ONNX embedding backends against the torch model.
+
+Encodes a fixed set of sentences with torch and with each ONNX backend and checks that
+every sentence's cosine similarity to the torch vector is at least the backend's
+threshold. Exits non-zero on a mismatch. It is skipped, with exit code 0, when torch,
+sentence-transformers or onnxruntime is not installed.
+
+    python check_embedding_parity.py
+    python check_embedding_parity.py --backends onnx --min-cosine 0.9995
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from typing import List
+
+import numpy as np
+
+from embedding_backend import load_sentence_model
+
+SENTENCES = [
+    "How does compound interest help my savings grow over time?",
+    "Pay off the credit card with the highest APR first.",
+    "A Roth IRA is funded with money you've already paid taxes on.",
+    "An emergency fund should cover three to six months of expenses.",
+    "Index funds spread your money across hundreds of companies for a low fee.",
+    "What happens to my credit score if I close an old card?",
+    "Automate your savings so the money moves before you can spend it.",
+    "Inflation slowly reduces what the cash in a checking account can buy.",
+]
+
+# fp32 should match torch up to float rounding; int8 weights give up a little accuracy
+MIN_COSINE = {"onnx": 0.999, "onnx-int8": 0.98}
+
+
+class ParityError(Exception):
+    pass
+
+
+def missing_modules(modules: List[str]) -> List[str]:
+    return [module for module in modules if importlib.util.find_spec(module) is None]
+
+
+def check_parity(model_name: str, backends: List[str], min_cosine: dict = MIN_COSINE) -> int:
+    """Raises ParityError on the first backend out of parity; returns how many backends were checked."""
+    missing = missing_modules(["torch", "sentence_transformers", "onnxruntime"])
+    if missing:
+        print(f"Skipped: {', '.join(missing)} not installed")
+        return 0
+
+    reference = np.asarray(load_sentence_model(model_name, "torch").encode(SENTENCES, normalize_embeddings=True), dtype="float32")
+    for backend in backends:
+        vectors = np.asarray(load_sentence_model(model_name, backend).encode(SENTENCES, normalize_embeddings=True), dtype="float32")
+        if vectors.shape != reference.shape:
+            raise ParityError(f"{backend}: vectors of shape {vectors.shape}, torch gives {reference.shape}")
+        cosines = np.sum(vectors * reference, axis=1)
+        worst = int(np.argmin(cosines))
+        if cosines[worst] < min_cosine[backend]:
+            raise ParityError(f"{backend}: cosine {cosines[worst]:.5f} to torch is below {min_cosine[backend]} for {SENTENCES[worst]!r}")
+        print(f"{backend:<12}min cosine {cosines.min():.5f}  mean {cosines.mean():.5f}  ok")
+    return len(backends)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    parser.add_argument("--backends", nargs="+", default=list(MIN_COSINE), choices=list(MIN_COSINE))
+    parser.add_argument("--min-cosine", type=float, help="one threshold for every backend instead of the defaults")
+    args = parser.parse_args()
+
+    thresholds = dict.fromkeys(MIN_COSINE, args.min_cosine) if args.min_cosine is not None else MIN_COSINE
+    try:
+        check_parity(args.model, args.backends, thresholds)
+    except ParityError as e:
+        print(f"Parity check failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import re
+from typing import Callable, List, Optional, Set, Tuple
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces, so chunks stay comfortably below that
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
+MIN_CHUNK_CHARS = int(os.getenv("MIN_CHUNK_CHARS", "40"))
+
+Span = Tuple[int, int]
+
+
+def whitespace_spans(text: str) -> List[Span]:
+    return [m.span() for m in re.finditer(r"\S+", text)]
+
+
+def tokenizer_spans(tokenizer) -> Callable[[str], List[Span]]:
+    # Character offsets of each word piece, so chunk boundaries match what the model sees
+    def spans(text: str) -> List[Span]:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [tuple(span) for span in encoded["offset_mapping"] if span[1] > span[0]]
+    return spans
+
+
+def spans_for_model(sentence_model) -> Callable[[str], List[Span]]:
+    tokenizer = getattr(sentence_model, "tokenizer", None)
+    if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+        return tokenizer_spans(tokenizer)
+    return whitespace_spans
+
+
+def split_spans(spans: List[Span], chunk_tokens: int, overlap: int) -> List[Span]:
+    if not spans:
+        return []
+    step = max(1, chunk_tokens - overlap)
+    windows = []
+    for i in range(0, len(spans), step):
+        window = spans[i:i + chunk_tokens]
+        windows.append((window[0][0], window[-1][1]))
+        if i + chunk_tokens >= len(spans):
+            break
+    return windows
+
+
+def chunk_pages(
+    pages: List[str],
+    source: str,
+    token_spans: Callable[[str], List[Span]] = whitespace_spans,
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap: int = CHUNK_OVERLAP,
+    min_chars: int = MIN_CHUNK_CHARS,
+    seen: Optional[Set[bytes]] = None,
+) -> Tuple[List[str], List[dict]]:
+    """Split extracted pages into overlapping token windows, dropping empty and repeated chunks."""
+    texts = []
+    metadata = []
+    seen = set() if seen is None else seen
+    for page_number, page in enumerate(pages):
+        if not page or not page.strip():
+            continue
+        for start, end in split_spans(token_spans(page), chunk_tokens, overlap):
+            text = page[start:end].strip()
+            if len(text) < min_chars:
+                continue
+            digest = hashlib.sha1(re.sub(r"\s+", " ", text).lower().encode("utf-8")).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            texts.append(text)
+            metadata.append({"source": source, "page": page_number, "start": start, "end": end})
+    return texts, metadata
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from instrumentation import estimate_tokens
+
+# Context budgeting settings, overridable from .env
+CONTEXT_BUDGETING = os.getenv("CONTEXT_BUDGETING", "true").lower() == "true"
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1000"))
+CONTEXT_BUDGETS = {
+    "chat": int(os.getenv("CONTEXT_TOKENS_CHAT", "1200")),
+    "lesson": int(os.getenv("CONTEXT_TOKENS_LESSON", "800")),
+    "subtopics": int(os.getenv("CONTEXT_TOKENS_SUBTOPICS", "600")),
+    "quiz": int(os.getenv("CONTEXT_TOKENS_QUIZ", "1000")),
+}
+# 1.0 ranks by relevance only; lower values favour chunks unlike the ones already picked
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Chunks this similar to an already selected one are dropped as near-duplicates
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.95"))
+SENTENCES_PER_CHUNK = int(os.getenv("SENTENCES_PER_CHUNK", "4"))
+MIN_SENTENCE_SIMILARITY = float(os.getenv("MIN_SENTENCE_SIMILARITY", "0.2"))
+SENTENCE_CACHE_CHUNKS = int(os.getenv("SENTENCE_CACHE_CHUNKS", "2048"))
+
+# Sentence ends and blank lines; single line breaks in PDF text are usually just wrapping
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+MIN_SENTENCE_CHARS = 40
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences = []
+    for piece in SENTENCE_BOUNDARY.split(text):
+        piece = " ".join(piece.split())
+        if not piece:
+            continue
+        # Fragments like "How?" or a stray heading read better attached to the next sentence
+        if sentences and len(sentences[-1]) < MIN_SENTENCE_CHARS:
+            sentences[-1] = f"{sentences[-1]} {piece}"
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def context_budget(endpoint: str) -> int:
+    return CONTEXT_BUDGETS.get(endpoint, CONTEXT_TOKENS)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def mmr_order(relevance: np.ndarray, vectors: np.ndarray, lam: float = MMR_LAMBDA, duplicate: float = DUPLICATE_SIMILARITY) -> List[int]:
+    """Maximal marginal relevance ordering of unit vectors; near-duplicates are left out."""
+    remaining = list(range(len(relevance)))
+    selected: List[int] = []
+    max_similarity = np.zeros(len(relevance), dtype="float32")
+    while remaining:
+        scores = [lam * relevance[i] - (1 - lam) * max_similarity[i] if selected else relevance[i] for i in remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        if selected and max_similarity[best] >= duplicate:
+            continue
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[best])
+    return selected
+
+
+class ContextBuilder:
+    """
+    Turns retrieved chunks into a prompt context that fits a token budget. Chunks are
+    ordered by maximal marginal relevance over their stored embeddings, so near-duplicates
+    (overlapping windows, the same paragraph in two PDFs) don't crowd out other material,
+    and each chunk is cut down to its sentences most similar to the query. Sentences are
+    only encoded for chunks that can still make it into the budget, and their embeddings
+    are cached per chunk, so popular chunks are only encoded once.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        max_cached_chunks: int = SENTENCE_CACHE_CHUNKS,
+        sentences_per_chunk: int = SENTENCES_PER_CHUNK,
+        min_sentence_similarity: float = MIN_SENTENCE_SIMILARITY,
+    ):
+        self.encode = encode
+        self.max_cached_chunks = max_cached_chunks
+        self.sentences_per_chunk = sentences_per_chunk
+        self.min_sentence_similarity = min_sentence_similarity
+        self._cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"chunks": 0, "encoded_chunks": 0, "cached_chunks": 0, "tokens_in": 0, "tokens_out": 0}
+
+    def _sentence_vectors(self, chunks: Sequence[str]) -> List[tuple]:
+        # (sentences, unit vectors) per chunk; uncached chunks are encoded in one call
+        keys = [hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).digest() for chunk in chunks]
+        entries: List[Optional[tuple]] = [None] * len(chunks)
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._cache.get(key)
+                if entry is not None:
+                    self._cache.move_to_end(key)
+                    entries[i] = entry
+            missing = [i for i, entry in enumerate(entries) if entry is None]
+            self.stats["encoded_chunks"] += len(missing)
+            self.stats["cached_chunks"] += len(chunks) - len(missing)
+        if missing:
+            sentences = [split_sentences(chunks[i]) or [chunks[i]] for i in missing]
+            flat = [s for group in sentences for s in group]
+            vectors = _normalize(np.asarray(self.encode(flat), dtype="float32"))
+            start = 0
+            with self._lock:
+                for i, group in zip(missing, sentences):
+                    entries[i] = (group, vectors[start:start + len(group)])
+                    start += len(group)
+                    self._cache[keys[i]] = entries[i]
+                while len(self._cache) > self.max_cached_chunks:
+                    self._cache.popitem(last=False)
+        return entries
+
+    def _trim(self, sentences: List[str], similarity: np.ndarray) -> List[int]:
+        # Best sentences above the similarity floor (always at least one), in reading order
+        ranked = np.argsort(-similarity)[:self.sentences_per_chunk]
+        keep = [int(i) for i in ranked if similarity[i] >= self.min_sentence_similarity] or [int(ranked[0])]
+        return sorted(keep)
+
+    def build(self, query_vector: np.ndarray, chunks: Sequence[str], budget: int, chunk_vectors: Optional[np.ndarray] = None) -> str:
+        # chunk_vectors are the chunks' stored embeddings; without them the chunk texts are encoded once more
+        if not chunks:
+            return ""
+        query = _normalize(np.asarray(query_vector, dtype="float32").reshape(-1))
+        if chunk_vectors is None:
+            chunk_vectors = self.encode(list(chunks))
+        chunk_vectors = _normalize(np.asarray(chunk_vectors, dtype="float32"))
+        order = mmr_order(chunk_vectors @ query, chunk_vectors)
+
+        parts, used, seen = [], 0, set()
+        position = 0
+        while position < len(order) and used < budget:
+            # Sentences are encoded for the next chunks that could fill the rest of the budget untrimmed;
+            # trimming usually leaves room, and then the following chunks are encoded in another round
+            batch, expected = [], 0
+            for i in order[position:]:
+                batch.append(i)
+                expected += estimate_tokens(chunks[i])
+                if used + expected >= budget:
+                    break
+            position += len(batch)
+            for i, (sentences, vectors) in zip(batch, self._sentence_vectors([chunks[i] for i in batch])):
+                similarity = vectors @ query
+                kept = []
+                for j in self._trim(sentences, similarity):
+                    key = sentences[j].lower()
+                    # Overlapping chunk windows repeat sentences
+                    if key in seen:
+                        continue
+                    cost = estimate_tokens(sentences[j]) + 1
+                    if used + cost > budget:
+                        continue
+                    seen.add(key)
+                    kept.append(sentences[j])
+                    used += cost
+                if kept:
+                    parts.append(" ".join(kept))
+                if used >= budget:
+                    break
+        context = "\n\n".join(parts)
+        tokens_in = sum(estimate_tokens(chunk) for chunk in chunks)
+        with self._lock:
+            self.stats["chunks"] += len(chunks)
+            self.stats["tokens_in"] += tokens_in
+            self.stats["tokens_out"] += estimate_tokens(context)
+        return context
@@ -0,0 +1,257 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from ann_index import build_ann_index, index_settings
+from chunking import CHUNK_OVERLAP, CHUNK_TOKENS, MIN_CHUNK_CHARS
+from doc_store import DocumentStore, DocumentStoreWriter
+from ingest import INGEST_WORKERS, create_extraction_pool, ingest_file
+from lexical_index import LexicalIndex, lexical_settings
+
+# Bump whenever the on-disk layout changes so stale artifacts get rebuilt
+INDEX_FORMAT_VERSION = 3
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.bin"
+LEXICAL_FILE = "lexical.npz"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".build.lock"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_pdfs(data_dir: str) -> List[str]:
+    return sorted(f for f in os.listdir(data_dir) if f.lower().endswith(".pdf"))
+
+
+@contextmanager
+def build_lock(index_dir: str):
+    # One worker builds, the others block here and then load what it wrote
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def current_build_dir(index_dir: str):
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE)) as f:
+            build_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+    build_dir = os.path.join(index_dir, build_id)
+    return build_dir if os.path.isdir(build_dir) else None
+
+
+def read_manifest(build_dir: str):
+    if build_dir is None:
+        return None
+    try:
+        with open(os.path.join(build_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def scan_corpus(data_dir: str, previous: Dict[str, dict] = None) -> Dict[str, dict]:
+    # Size and mtime let us skip re-hashing unchanged PDFs on every start
+    previous = previous or {}
+    files = {}
+    for name in list_pdfs(data_dir):
+        stat = os.stat(os.path.join(data_dir, name))
+        old = previous.get(name)
+        if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+            sha = old["sha256"]
+        else:
+            sha = file_sha256(os.path.join(data_dir, name))
+        files[name] = {"sha256": sha, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return files
+
+
+def chunking_settings() -> dict:
+    return {"chunk_tokens": CHUNK_TOKENS, "overlap": CHUNK_OVERLAP, "min_chars": MIN_CHUNK_CHARS}
+
+
+def is_compatible(manifest, model_name: str) -> bool:
+    # Stored embeddings can only be reused if they were produced the same way
+    return (
+        manifest is not None
+        and manifest.get("version") == INDEX_FORMAT_VERSION
+        and manifest.get("model") == model_name
+        and manifest.get("chunking") == chunking_settings()
+    )
+
+
+def is_up_to_date(manifest, files: Dict[str, dict], model_name: str) -> bool:
+    if not is_compatible(manifest, model_name):
+        return False
+    if manifest.get("index") != index_settings() or manifest.get("lexical") != lexical_settings():
+        return False
+    old = manifest["files"]
+    return old.keys() == files.keys() and all(old[n]["sha256"] == files[n]["sha256"] for n in files)
+
+
+def build_index(data_dir: str, index_dir: str, sentence_model, model_name: str, log=print, progress=None, workers: int = INGEST_WORKERS) -> str:
+    previous_dir = current_build_dir(index_dir)
+    previous = read_manifest(previous_dir)
+    reusable = is_compatible(previous, model_name)
+    files = scan_corpus(data_dir, previous["files"] if reusable else None)
+
+    if reusable:
+        old_embeddings = np.load(os.path.join(previous_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        old_store = DocumentStore(os.path.join(previous_dir, DOCUMENTS_FILE))
+
+    # Write into a fresh build directory and flip CURRENT atomically at the end
+    build_id = f"build-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    build_dir = os.path.join(index_dir, build_id)
+    os.makedirs(build_dir)
+
+    dim = sentence_model.get_sentence_embedding_dimension()
+    # Chunk texts stream straight into the new store instead of accumulating in memory
+    store = DocumentStoreWriter(os.path.join(build_dir, DOCUMENTS_FILE))
+    parts = []
+    pool = None
+    try:
+        for name, info in files.items():
+            old = previous["files"].get(name) if reusable else None
+            if old and old["sha256"] == info["sha256"]:
+                start, count = old["start"], old["count"]
+                chunks = (old_store[i] for i in range(start, start + count))
+                chunk_metadata = (old_store.metadata(i) for i in range(start, start + count))
+                vectors = old_embeddings[start:start + count]
+            else:
+                log(f"Embedding {name}")
+                if pool is None and workers > 1:
+                    pool = create_extraction_pool(workers)
+                chunks, chunk_metadata, vectors = ingest_file(os.path.join(data_dir, name), name, sentence_model, pool, progress=progress)
+                # Spill each file's vectors to disk so peak memory stays at one file
+                part_path = os.path.join(build_dir, f"part-{len(parts)}.npy")
+                np.save(part_path, vectors)
+                vectors = np.load(part_path, mmap_mode="r")
+            info["start"] = len(store)
+            for text, item in zip(chunks, chunk_metadata):
+                store.add(text, item)
+            info["count"] = len(store) - info["start"]
+            parts.append(vectors)
+        store.close()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    matrix = np.lib.format.open_memmap(os.path.join(build_dir, EMBEDDINGS_FILE), mode="w+", dtype="float32", shape=(len(store), dim))
+    row = 0
+    for vectors in parts:
+        matrix[row:row + len(vectors)] = vectors
+        row += len(vectors)
+    matrix.flush()
+    del parts
+    for entry in os.listdir(build_dir):
+        if entry.startswith("part-"):
+            os.remove(os.path.join(build_dir, entry))
+
+    # Changing INDEX_TYPE only retrains the index; the stored embeddings are reused
+    index = build_ann_index(matrix, index_settings())
+    faiss.write_index(index, os.path.join(build_dir, INDEX_FILE))
+    # The BM25 index only needs the chunk texts, so it is rebuilt from the new store
+    documents = DocumentStore(os.path.join(build_dir, DOCUMENTS_FILE))
+    LexicalIndex.build(documents[i] for i in range(len(documents))).save(os.path.join(build_dir, LEXICAL_FILE))
+    manifest = {
+        "version": INDEX_FORMAT_VERSION,
+        "model": model_name,
+        "chunking": chunking_settings(),
+        "index": index_settings(),
+        "lexical": lexical_settings(),
+        "dim": dim,
+        "num_documents": len(store),
+        "files": files,
+    }
+    with open(os.path.join(build_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    tmp_current = os.path.join(index_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_current, "w") as f:
+        f.write(build_id)
+    os.replace(tmp_current, os.path.join(index_dir, CURRENT_FILE))
+
+    # Older builds may still be mapped by running workers; keep only the previous one
+    for entry in os.listdir(index_dir):
+        path = os.path.join(index_dir, entry)
+        if entry.startswith("build-") and path not in (build_dir, previous_dir):
+            shutil.rmtree(path, ignore_errors=True)
+    return build_dir
+
+
+def load_index(build_dir: str) -> Tuple[faiss.Index, DocumentStore, LexicalIndex, np.ndarray]:
+    index = faiss.read_index(os.path.join(build_dir, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    store = DocumentStore(os.path.join(build_dir, DOCUMENTS_FILE))
+    # Chunk embeddings stay on disk; only the rows that are looked up get paged in
+    vectors = np.load(os.path.join(build_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    return index, store, LexicalIndex.load(os.path.join(build_dir, LEXICAL_FILE)), vectors
+
+
+def load_or_build_index(data_dir: str, index_dir: str, sentence_model, model_name: str) -> Tuple[faiss.Index, DocumentStore, LexicalIndex, np.ndarray]:
+    # Fast path without taking the lock: artifact exists and matches the corpus
+    build_dir = current_build_dir(index_dir)
+    manifest = read_manifest(build_dir)
+    if manifest is not None and is_up_to_date(manifest, scan_corpus(data_dir, manifest["files"]), model_name):
+        return load_index(build_dir)
+
+    with build_lock(index_dir):
+        # Another worker may have finished the build while we waited
+        build_dir = current_build_dir(index_dir)
+        manifest = read_manifest(build_dir)
+        if not is_up_to_date(manifest, scan_corpus(data_dir, manifest["files"] if manifest else None), model_name):
+            build_dir = build_index(data_dir, index_dir, sentence_model, model_name)
+    return load_index(build_dir)
+
+
+def print_progress(source: str, stage: str, done: int, total: int):
+    end = "\n" if stage == "chunks" and done == total else ""
+    print(f"\r  {source[:60]:<60} {stage:>6} {done}/{total}", end=end, flush=True)
+
+
+if __name__ == "__main__":
+    # Build step: python corpus_index.py [--data-dir DIR] [--index-dir DIR] [--workers N]
+    import argparse
+    from embedding_backend import load_sentence_model
+
+    current_directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build or refresh the on-disk corpus index")
+    parser.add_argument("--data-dir", default=os.getenv("DATA_DIR", os.path.join(current_directory, "data")))
+    parser.add_argument("--index-dir", default=os.getenv("INDEX_DIR", os.path.join(current_directory, "index_cache")))
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="processes used for PDF text extraction")
+    args = parser.parse_args()
+    model_name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+    with build_lock(args.index_dir):
+        build_dir = current_build_dir(args.index_dir)
+        manifest = read_manifest(build_dir)
+        if is_up_to_date(manifest, scan_corpus(args.data_dir, manifest["files"] if manifest else None), model_name):
+            print(f"Index at {build_dir} is up to date ({manifest['num_documents']} chunks)")
+        else:
+            started = time.time()
+            build_dir = build_index(
+                args.data_dir, args.index_dir, load_sentence_model(model_name), model_name,
+                progress=print_progress, workers=args.workers,
+            )
+            print(f"Wrote index to {build_dir} in {time.time() - started:.1f}s")
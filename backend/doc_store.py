@@ -0,0 +1,143 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+# Compress each chunk with zlib when writing; readers detect it from the header
+DOC_STORE_COMPRESS = os.getenv("DOC_STORE_COMPRESS", "false").lower() == "true"
+
+MAGIC = b"DOCSTORE"
+FORMAT_VERSION = 1
+FLAG_ZLIB = 1
+# magic, version, flags, count, data offset, offsets offset, metadata offset, sources offset
+HEADER = struct.Struct("<8sIIQQQQQ")
+META_DTYPE = np.dtype([("source", "<u4"), ("page", "<u4"), ("start", "<u4"), ("end", "<u4"), ("chunk", "<u4")])
+
+
+def _pad_to(f, alignment: int = 8) -> int:
+    position = f.tell()
+    padding = -position % alignment
+    if padding:
+        f.write(b"\0" * padding)
+    return position + padding
+
+
+class DocumentStoreWriter:
+    """
+    Appends chunk texts and their metadata to a single file. Texts are written as they
+    arrive; only the offsets and metadata columns are kept in memory until close().
+    """
+
+    def __init__(self, path: str, compress: bool = DOC_STORE_COMPRESS):
+        self.path = path
+        self.compress = compress
+        self._file = open(path, "wb")
+        self._file.write(b"\0" * HEADER.size)
+        self._data_offset = HEADER.size
+        self._offsets = [0]
+        self._meta: List[tuple] = []
+        self._sources: List[str] = []
+        self._source_ids = {}
+        self._chunks_per_source: List[int] = []
+
+    def add(self, text: str, metadata: dict):
+        data = text.encode("utf-8")
+        if self.compress:
+            data = zlib.compress(data)
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+        source = metadata["source"]
+        if source not in self._source_ids:
+            self._source_ids[source] = len(self._sources)
+            self._sources.append(source)
+            self._chunks_per_source.append(0)
+        source_id = self._source_ids[source]
+        self._meta.append((source_id, metadata["page"], metadata["start"], metadata["end"], self._chunks_per_source[source_id]))
+        self._chunks_per_source[source_id] += 1
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def close(self):
+        f = self._file
+        offsets_offset = _pad_to(f)
+        f.write(np.asarray(self._offsets, dtype="<u8").tobytes())
+        meta_offset = _pad_to(f)
+        f.write(np.array(self._meta, dtype=META_DTYPE).tobytes())
+        sources_offset = f.tell()
+        f.write(json.dumps(self._sources).encode("utf-8"))
+        f.seek(0)
+        flags = FLAG_ZLIB if self.compress else 0
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(self._meta), self._data_offset, offsets_offset, meta_offset, sources_offset))
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+class DocumentStore:
+    """
+    Read-only view over a file written by DocumentStoreWriter. The file is memory-mapped,
+    so every worker process shares the same pages through the OS page cache, and the
+    offsets and metadata columns are numpy views straight onto the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, count, data_offset, offsets_offset, meta_offset, sources_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} document store")
+        self.compressed = bool(flags & FLAG_ZLIB)
+        self._count = count
+        self._data_offset = data_offset
+        self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=count + 1, offset=offsets_offset)
+        self.columns = np.frombuffer(self._mmap, dtype=META_DTYPE, count=count, offset=meta_offset)
+        self.sources: List[str] = json.loads(self._mmap[sources_offset:].decode("utf-8"))
+        self._view = memoryview(self._mmap)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def raw(self, i: int) -> memoryview:
+        # Zero-copy slice of the stored bytes (compressed if the store is)
+        start = self._data_offset + int(self._offsets[i])
+        end = self._data_offset + int(self._offsets[i + 1])
+        return self._view[start:end]
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        data = self.raw(i)
+        if self.compressed:
+            return zlib.decompress(data).decode("utf-8")
+        return str(data, "utf-8")
+
+    def metadata(self, i: int) -> dict:
+        row = self.columns[i]
+        return {
+            "source": self.sources[row["source"]],
+            "page": int(row["page"]),
+            "start": int(row["start"]),
+            "end": int(row["end"]),
+            "chunk": int(row["chunk"]),
+        }
+
+    def ids_for_source(self, source: str) -> Optional[np.ndarray]:
+        if source not in self.sources:
+            return None
+        return np.flatnonzero(self.columns["source"] == self.sources.index(source))
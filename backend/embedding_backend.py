@@ -0,0 +1,147 @@
+import json
+import os
+import re
+from typing import List, Union
+
+import numpy as np
+
+# "torch" runs SentenceTransformer as before; "onnx" and "onnx-int8" run the same model
+# through ONNX Runtime, the latter with int8 dynamically quantized weights
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_cache"))
+# Threads per ONNX Runtime call; 0 lets ORT decide. Keep EMBEDDING_WORKERS * ONNX_THREADS near the core count
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+
+ENCODER_CONFIG_FILE = "encoder.json"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model-int8.onnx"
+
+
+def onnx_model_dir(model_name: str, cache_dir: str = ONNX_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+
+
+class OnnxSentenceEncoder:
+    """
+    Drop-in replacement for the parts of SentenceTransformer the backend uses (encode,
+    get_sentence_embedding_dimension, tokenizer) backed by an exported ONNX graph.
+    Pooling and normalization follow the exported model's own configuration, so vectors
+    have the same dimension and stay compatible with indexes built by the torch backend.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE)) as f:
+            self.config = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_path = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config["max_seq_length"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+        feeds = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        if self.config["pooling"] == "cls":
+            embeddings = hidden[:, 0]
+        else:
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Batch texts of similar length together so little time goes into padding
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+        if normalize_embeddings or self.config["normalize"]:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name: str, model_dir: str, opset: int = 17):
+    # One-off export; needs torch and sentence-transformers, which serving with ONNX does not
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next((module for module in model if type(module).__name__ == "Pooling"), None)
+    pooling_mode = pooling.get_pooling_mode_str() if pooling is not None else "mean"
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"{model_name} uses {pooling_mode} pooling; the ONNX backend supports mean and cls")
+
+    dummy = model.tokenizer(["An example sentence to trace the graph"], return_tensors="pt")
+    input_names = list(dummy.keys())
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, FP32_FILE)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()),
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    quantize_dynamic(fp32_path, os.path.join(model_dir, INT8_FILE), weight_type=QuantType.QInt8)
+    model.tokenizer.save_pretrained(model_dir)
+
+    config = {
+        "model": model_name,
+        "dim": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling_mode,
+        "normalize": any(type(module).__name__ == "Normalize" for module in model),
+    }
+    with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def load_sentence_model(model_name: str, backend: str = EMBEDDING_BACKEND, cache_dir: str = ONNX_CACHE_DIR):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected one of {', '.join(EMBEDDING_BACKENDS)}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name)
+
+    model_dir = onnx_model_dir(model_name, cache_dir)
+    if not os.path.exists(os.path.join(model_dir, ENCODER_CONFIG_FILE)):
+        from corpus_index import build_lock
+
+        # Several workers may start at once; one exports, the rest load its output
+        with build_lock(cache_dir):
+            if not os.path.exists(os.path.join(model_dir, ENCODER_CONFIG_FILE)):
+                export_onnx(model_name, model_dir)
+    return OnnxSentenceEncoder(model_dir, quantized=backend == "onnx-int8")
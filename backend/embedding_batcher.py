@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from executors import EMBEDDING_WORKERS, run_embedding
+from instrumentation import add_to_trace, observe
+
+# Micro-batching settings, overridable from .env
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "3"))
+
+
+class EmbeddingBatcher:
+    """
+    Collects retrieval queries from concurrent requests for a few milliseconds, encodes
+    them as one batch, runs one batched index search and hands each caller its own ids.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], np.ndarray],
+        search: Callable[[np.ndarray, int], Tuple[np.ndarray, np.ndarray]],
+        max_batch_size: int = EMBED_BATCH_SIZE,
+        max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+        max_inflight_batches: int = EMBEDDING_WORKERS,
+    ):
+        self.encode = encode
+        self.search = search
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._inflight = asyncio.Semaphore(max_inflight_batches)
+        self._queue = None
+        self._worker = None
+        # Running batches; the loop only keeps weak references to tasks
+        self._batches = set()
+
+    async def query(self, text: str, k: int) -> List[int]:
+        ids, _ = await self.query_with_vector(text, k)
+        return ids
+
+    async def query_with_vector(self, text: str, k: int) -> Tuple[List[int], np.ndarray]:
+        # Also returns the query embedding so later stages don't encode the query again
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, k, future))
+        ids, vector, encode_seconds, search_seconds = await future
+        # The batch served several requests; each one's trace gets the batch's timings
+        add_to_trace("embed", encode_seconds)
+        add_to_trace("index_search", search_seconds)
+        return ids, vector
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Keep collecting the next batch while this one is encoded on the embedding pool
+            await self._inflight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def stop(self):
+        # Cancels the collector and running batches; callers still waiting see CancelledError
+        tasks = list(self._batches)
+        if self._worker is not None:
+            tasks.append(self._worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait()[2].cancel()
+        self._worker = None
+
+    def _encode_and_search(self, texts: List[str], k: int):
+        started = time.perf_counter()
+        vectors = np.asarray(self.encode(texts), dtype="float32")
+        encoded = time.perf_counter()
+        _, ids = self.search(vectors, k)
+        searched = time.perf_counter()
+        observe("embed", encoded - started)
+        observe("index_search", searched - encoded)
+        return vectors, ids, encoded - started, searched - encoded
+
+    async def _run_batch(self, batch):
+        try:
+            live = [item for item in batch if not item[2].done()]
+            if not live:
+                return
+            k = max(item[1] for item in live)
+            try:
+                vectors, ids, encode_seconds, search_seconds = await run_embedding(self._encode_and_search, [item[0] for item in live], k)
+            except asyncio.CancelledError:
+                for _, _, future in live:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, _, future in live:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for row, (_, item_k, future) in enumerate(live):
+                if not future.done():
+                    hits = [int(i) for i in ids[row][:item_k] if i >= 0]
+                    future.set_result((hits, vectors[row], encode_seconds, search_seconds))
+        finally:
+            self._inflight.release()
@@ -0,0 +1,46 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# Separate bounded pools so a burst of slow Gemini calls can't starve
+# embedding/FAISS work or Firestore reads, and vice versa
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "32"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", str(min(4, os.cpu_count() or 1))))
+DB_WORKERS = int(os.getenv("DB_WORKERS", "16"))
+
+llm_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embedding")
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+# Runtime corpus changes are rare and heavy; one at a time keeps them off the embedding pool
+ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+
+async def run_in_executor(executor: ThreadPoolExecutor, func: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    # Carry context variables (e.g. the request's trace) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_llm(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await run_in_executor(llm_executor, func, *args, **kwargs)
+
+
+async def run_embedding(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await run_in_executor(embedding_executor, func, *args, **kwargs)
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await run_in_executor(db_executor, func, *args, **kwargs)
+
+
+async def run_ingest(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await run_in_executor(ingest_executor, func, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = True):
+    for executor in (llm_executor, embedding_executor, db_executor, ingest_executor):
+        executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import os
+import time
+import random
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Optional, TypeVar
+
+from executors import llm_executor, run_llm
+from instrumentation import add_to_trace, observe, track_inflight
+
+T = TypeVar("T")
+
+# Pipeline settings, overridable from .env
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF = float(os.getenv("LLM_BACKOFF", "0.5"))
+
+# Rate limits, server errors and deadlines; google.api_core exceptions carry the HTTP status as `code`
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: BaseException) -> bool:
+    # Bad requests, auth failures and safety blocks fail the same way on every attempt
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in TRANSIENT_STATUS
+
+
+class GenerationPipeline:
+    """
+    Runs blocking LLM calls concurrently with a shared limit, timeouts and retries of
+    transient errors. The timeout here only stops waiting; call_llm should also pass it to
+    the SDK so the request itself is abandoned and its pool thread freed.
+    """
+
+    def __init__(
+        self,
+        call_llm: Callable[[str], str],
+        stream_llm: Optional[Callable[[str], Iterator[str]]] = None,
+        concurrency: int = LLM_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff: float = LLM_BACKOFF,
+    ):
+        self.call_llm = call_llm
+        self.stream_llm = stream_llm
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run_blocking(self, prompt: str, call_llm: Optional[Callable[[str], str]] = None) -> str:
+        return await run_llm(call_llm or self.call_llm, prompt)
+
+    async def generate(self, prompt: str, call_llm: Optional[Callable[[str], str]] = None) -> str:
+        # call_llm overrides the default model for this call (e.g. a context-cached model)
+        attempt = 0
+        while True:
+            try:
+                queued = time.perf_counter()
+                async with self._semaphore:
+                    self._record_queue_wait(queued)
+                    with track_inflight("llm"):
+                        return await asyncio.wait_for(self._run_blocking(prompt, call_llm), self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                await self._backoff(attempt)
+                attempt += 1
+
+    @staticmethod
+    def _record_queue_wait(queued: float):
+        seconds = time.perf_counter() - queued
+        observe("llm_queue", seconds)
+        add_to_trace("llm_queue", seconds)
+
+    async def _backoff(self, attempt: int):
+        # Exponential backoff with jitter, outside the semaphore so others can proceed
+        delay = self.backoff * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, delay))
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        # Retries only happen before the first chunk; once text has been sent it can't be taken back
+        attempt = 0
+        while True:
+            started = False
+            try:
+                queued = time.perf_counter()
+                async with self._semaphore:
+                    self._record_queue_wait(queued)
+                    with track_inflight("llm"):
+                        async for chunk in self._iterate_in_thread(prompt):
+                            started = True
+                            yield chunk
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_transient(e):
+                    raise
+            await self._backoff(attempt)
+            attempt += 1
+
+    async def _iterate_in_thread(self, prompt: str) -> AsyncIterator[str]:
+        # Drives the blocking stream iterator on the LLM pool and hands chunks to the event loop
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        cancelled = False
+
+        def produce():
+            try:
+                for chunk in self.stream_llm(prompt):
+                    if cancelled:
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        loop.run_in_executor(llm_executor, contextvars.copy_context().run, produce)
+        try:
+            while True:
+                # The timeout applies between chunks rather than to the whole stream
+                item = await asyncio.wait_for(queue.get(), self.timeout)
+                if item is finished:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            cancelled = True
+
+    async def map(self, func: Callable[[T], Awaitable[str]], items: Iterable[T]) -> List[str]:
+        # gather keeps results in the order of the input items; one failure cancels the rest
+        tasks = [asyncio.ensure_future(func(item)) for item in items]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
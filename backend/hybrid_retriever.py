@@ -0,0 +1,62 @@
+import os
+from typing import Dict, List, Sequence
+
+from instrumentation import span
+
+# Retrieval settings, overridable from .env
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# How many vector and lexical hits go into fusion before cutting to k
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Cross-encoder re-ranking is off unless a model is named, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = RRF_K) -> List[int]:
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def load_reranker(model_name: str = RERANK_MODEL):
+    if not model_name:
+        return None
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name)
+
+
+class HybridRetriever:
+    """
+    Fuses the vector search ranking with a BM25 ranking over the same chunks using
+    reciprocal rank fusion, so exact terms like "Roth IRA" or "Way2Save" surface even
+    when the embedding misses them. An optional cross-encoder re-scores the fused top-N.
+    """
+
+    def __init__(self, reranker=None, enabled: bool = HYBRID_RETRIEVAL, candidates: int = HYBRID_CANDIDATES, rerank_top_n: int = RERANK_TOP_N):
+        self.reranker = reranker
+        self.enabled = enabled
+        self.candidates = candidates
+        self.rerank_top_n = rerank_top_n
+
+    def candidate_count(self, k: int) -> int:
+        # Number of vector hits the caller should fetch for combine()
+        if not self.enabled and self.reranker is None:
+            return k
+        return max(k, self.candidates, self.rerank_top_n if self.reranker is not None else 0)
+
+    def combine(self, corpus, query: str, vector_ids: List[int], k: int) -> List[int]:
+        ids = vector_ids
+        if self.enabled:
+            with span("lexical_search"):
+                lexical_ids = corpus.lexical_search(query, self.candidate_count(k))
+            ids = reciprocal_rank_fusion([vector_ids, lexical_ids], len(vector_ids) + len(lexical_ids))
+        if self.reranker is not None and ids:
+            top = ids[:max(k, self.rerank_top_n)]
+            with span("rerank"):
+                scores = self.reranker.predict([(query, corpus.text(i)) for i in top])
+            ids = [i for _, i in sorted(zip(scores, top), key=lambda item: item[0], reverse=True)]
+        return ids[:k]
@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import PyPDF2
+
+from chunking import chunk_pages, spans_for_model
+
+# Ingestion settings, overridable from .env
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+
+# progress(source, stage, done, total) with stage "pages" or "chunks"
+Progress = Callable[[str, str, int, int], None]
+
+
+def create_extraction_pool(workers: int = INGEST_WORKERS) -> ProcessPoolExecutor:
+    # spawn keeps children clean when the parent already runs threads (uvicorn, torch)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def count_pages(path: str) -> int:
+    with open(path, "rb") as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+
+def extract_page_range(path: str, start: int, end: int) -> List[str]:
+    # Runs in a pool worker; each task parses its own reader so nothing large is pickled
+    with open(path, "rb") as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pages(path: str, pool: Optional[Executor] = None, pages_per_task: int = INGEST_PAGES_PER_TASK) -> Iterator[List[str]]:
+    """Yield page texts in order, one extraction task's worth at a time."""
+    total = count_pages(path)
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+    if pool is None:
+        for start, end in ranges:
+            yield extract_page_range(path, start, end)
+        return
+    futures = [pool.submit(extract_page_range, path, start, end) for start, end in ranges]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def ingest_file(
+    path: str,
+    source: str,
+    sentence_model,
+    pool: Optional[Executor] = None,
+    batch_size: int = INGEST_BATCH_SIZE,
+    progress: Optional[Progress] = None,
+) -> Tuple[List[str], List[dict], np.ndarray]:
+    """
+    Stream one PDF through extraction, chunking and batched embedding. Pages are chunked
+    as soon as their extraction task finishes and chunks are encoded batch by batch, so
+    only one file's text and vectors are held at a time.
+    """
+    token_spans = spans_for_model(sentence_model)
+    dim = sentence_model.get_sentence_embedding_dimension()
+    total_pages = count_pages(path)
+    texts: List[str] = []
+    metadata: List[dict] = []
+    vectors: List[np.ndarray] = []
+    seen = set()
+    pages_done = 0
+    encoded = 0
+
+    def encode_pending(flush: bool):
+        nonlocal encoded
+        while len(texts) - encoded >= batch_size or (flush and len(texts) > encoded):
+            batch = texts[encoded:encoded + batch_size]
+            vectors.append(np.asarray(sentence_model.encode(batch), dtype="float32"))
+            encoded += len(batch)
+            if progress:
+                progress(source, "chunks", encoded, len(texts))
+
+    for pages in iter_pages(path, pool):
+        # Page numbers continue across tasks and duplicates are tracked across the whole file
+        offset = pages_done
+        chunk_texts, chunk_metadata = chunk_pages(pages, source, token_spans, seen=seen)
+        for item in chunk_metadata:
+            item["page"] += offset
+        texts.extend(chunk_texts)
+        metadata.extend(chunk_metadata)
+        pages_done += len(pages)
+        if progress:
+            progress(source, "pages", pages_done, total_pages)
+        encode_pending(flush=False)
+    encode_pending(flush=True)
+
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, dim), dtype="float32")
+    return texts, metadata, matrix
@@ -0,0 +1,248 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Metrics are on by default; with both flags off spans are a no-op and no middleware is installed
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Adds a Server-Timing header with the request's per-stage totals (visible in browser dev tools)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+ENABLED = METRICS_ENABLED or SERVER_TIMING
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.buckets = buckets
+        # labels -> [count per bucket (last is +Inf), sum, count]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        with self._lock:
+            snapshot = [(labels, list(entry[0]), entry[1], entry[2]) for labels, entry in self._values.items()]
+        out = []
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append((f"{self.name}_bucket", labels + (("le", le),), cumulative))
+            out.append((f"{self.name}_sum", labels, total))
+            out.append((f"{self.name}_count", labels, count))
+        return out
+
+
+class Registry:
+    """Minimal Prometheus text-format registry; collectors add gauges computed at scrape time."""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]):
+        # collector() yields (name, help, labels, value) gauge samples
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        described = set()
+        for collector in self._collectors:
+            for name, help, labels, value in collector():
+                if name not in described:
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} gauge")
+                    described.add(name)
+                lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_seconds = registry.register(Histogram("stage_seconds", "Time spent in each hot-path stage"))
+http_request_seconds = registry.register(Histogram("http_request_seconds", "HTTP request latency by route"))
+http_inflight = registry.register(Gauge("http_requests_inflight", "HTTP requests currently being served"))
+inflight = registry.register(Gauge("inflight", "Operations currently in progress by kind"))
+llm_tokens = registry.register(Histogram("llm_tokens", "Prompt and response sizes in tokens", TOKEN_BUCKETS))
+cache_requests = registry.register(Counter("cache_requests_total", "Cache lookups by cache and result"))
+
+
+class Trace:
+    """Per-request stage totals, shared by every task and executor thread serving the request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self) -> str:
+        with self._lock:
+            stages = [(stage, total, count) for stage, (total, count) in self.stages.items()]
+        parts = [f'{stage.replace(".", "_")};dur={total * 1000:.1f};desc="{stage} x{count}"' for stage, total, count in stages]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_NOOP = nullcontext()
+
+
+def observe(stage: str, seconds: float):
+    # Global histogram only, e.g. for a batch that serves several requests at once
+    if METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage=stage)
+
+
+def add_to_trace(stage: str, seconds: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def _span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        observe(stage, seconds)
+        add_to_trace(stage, seconds)
+
+
+def span(stage: str):
+    return _span(stage) if ENABLED else _NOOP
+
+
+@contextmanager
+def _track_inflight(kind: str):
+    inflight.inc(kind=kind)
+    try:
+        yield
+    finally:
+        inflight.dec(kind=kind)
+
+
+def track_inflight(kind: str):
+    return _track_inflight(kind) if METRICS_ENABLED else _NOOP
+
+
+def count_tokens(kind: str, tokens: int):
+    if METRICS_ENABLED:
+        llm_tokens.observe(tokens, kind=kind)
+
+
+def count_cache(cache: str, hit: bool):
+    if METRICS_ENABLED:
+        cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def estimate_tokens(text: str) -> int:
+    # Gemini averages about four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def install(app):
+    """Adds the timing middleware to a FastAPI app; does nothing when instrumentation is off."""
+    if not ENABLED:
+        return
+
+    @app.middleware("http")
+    async def record_request(request, call_next):
+        trace = Trace()
+        token = current_trace.set(trace)
+        http_inflight.inc()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if SERVER_TIMING:
+                response.headers["Server-Timing"] = trace.server_timing()
+            return response
+        finally:
+            http_inflight.dec()
+            current_trace.reset(token)
+            if METRICS_ENABLED:
+                route = request.scope.get("route")
+                http_request_seconds.observe(
+                    time.perf_counter() - trace.started,
+                    route=getattr(route, "path", "unmatched"), method=request.method, status=status,
+                )
@@ -0,0 +1,265 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job settings, overridable from .env
+# Jobs processed at once by this process; 0 leaves generation to a separate `python job_worker.py`
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A running job whose worker stops renewing its lease (crash, restart) is picked up again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Finished jobs (and their idempotency keys) are kept this long
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+
+FINISHED = ("succeeded", "failed")
+
+# handler(payload, progress, report_progress) -> result; progress holds what an earlier attempt saved
+Handler = Callable[[dict, dict, Callable[[dict], Awaitable[None]]], Awaitable[dict]]
+
+
+class JobStore:
+    """
+    SQLite-backed job queue. Workers claim jobs with a lease they keep renewing, so a
+    job held by a worker that died is handed out again once the lease runs out. Partial
+    progress is saved with the job, letting a retried job skip work already done.
+    Several processes on one host can share the same file.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Autocommit; claims and submissions take an explicit write lock across processes
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                idempotency_key TEXT UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, available_at);
+        """)
+
+    def _to_dict(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["progress"] = json.loads(job["progress"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def submit(self, kind: str, payload: dict, idempotency_key: Optional[str] = None) -> Tuple[dict, bool]:
+        """Returns (job, created); a key already used by a queued, running or succeeded job returns that job."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if idempotency_key is not None:
+                    row = self._db.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                    if row is not None and row["status"] != "failed":
+                        self._db.execute("COMMIT")
+                        return self._to_dict(row), False
+                    # A failed job gives its key up so the work can be submitted again
+                    self._db.execute("UPDATE jobs SET idempotency_key = NULL WHERE idempotency_key = ?", (idempotency_key,))
+                job_id = uuid.uuid4().hex
+                self._db.execute(
+                    "INSERT INTO jobs (id, kind, idempotency_key, payload, status, available_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, kind, idempotency_key, json.dumps(payload), now, now, now),
+                )
+                row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._to_dict(row), True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def claim(self) -> Optional[dict]:
+        """Takes the oldest runnable job: queued and due, or running with an expired lease."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases that used up their attempts fail instead of running again
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'worker stopped responding', lease_until = NULL, updated_at = ? "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                        (now + self.lease_seconds, now, row["id"]),
+                    )
+                    row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._to_dict(row) if row is not None else None
+
+    def _update(self, job_id: str, sql: str, params: tuple):
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {sql}, updated_at = ? WHERE id = ?", params + (time.time(), job_id))
+
+    def renew(self, job_id: str):
+        self._update(job_id, "lease_until = ?", (time.time() + self.lease_seconds,))
+
+    def save_progress(self, job_id: str, progress: dict):
+        self._update(job_id, "progress = ?, lease_until = ?", (json.dumps(progress), time.time() + self.lease_seconds))
+
+    def complete(self, job_id: str, result: dict):
+        self._update(job_id, "status = 'succeeded', result = ?, error = NULL, lease_until = NULL", (json.dumps(result),))
+
+    def fail(self, job_id: str, error: str, retry: bool = True):
+        # Retried with a growing delay until attempts run out; saved progress is kept
+        job = self.get(job_id)
+        if retry and job is not None and job["attempts"] < self.max_attempts:
+            delay = JOB_RETRY_DELAY * job["attempts"]
+            self._update(job_id, "status = 'queued', error = ?, lease_until = NULL, available_at = ?", (error, time.time() + delay))
+        else:
+            self._update(job_id, "status = 'failed', error = ?, lease_until = NULL", (error,))
+
+    def release(self, job_id: str):
+        # Worker is shutting down: hand the job back without counting the attempt
+        self._update(job_id, "status = 'queued', attempts = MAX(attempts - 1, 0), lease_until = NULL", ())
+
+    def purge(self, retention: float = JOB_RETENTION) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", FINISHED + (time.time() - retention,)
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobWorker:
+    """Runs claimed jobs with the handler registered for their kind, at most `concurrency` at a time."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Handler],
+        run_blocking: Callable[..., Awaitable],
+        concurrency: int = JOB_WORKERS,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.run_blocking = run_blocking
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wake = None
+        self._tasks = []
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._purge()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def trigger(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _keep_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            await self.run_blocking(self.store.renew, job_id)
+
+    async def process(self, job: dict):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            await self.run_blocking(self.store.fail, job["id"], f"no handler for job kind {job['kind']!r}", False)
+            return
+        progress = dict(job["progress"])
+        save_lock = asyncio.Lock()
+
+        async def report_progress(update: dict):
+            progress.update(update)
+            # Snapshot now and save in call order, so a slow write never overwrites a newer one
+            snapshot = copy.deepcopy(progress)
+            async with save_lock:
+                await self.run_blocking(self.store.save_progress, job["id"], snapshot)
+
+        lease = asyncio.create_task(self._keep_lease(job["id"]))
+        try:
+            result = await handler(job["payload"], progress, report_progress)
+        except asyncio.CancelledError:
+            await asyncio.shield(self.run_blocking(self.store.release, job["id"]))
+            raise
+        except Exception as e:
+            logger.exception("Job %s (%s) failed on attempt %d", job["id"], job["kind"], job["attempts"])
+            await self.run_blocking(self.store.fail, job["id"], str(e) or type(e).__name__)
+        else:
+            await self.run_blocking(self.store.complete, job["id"], result)
+        finally:
+            lease.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                job = await self.run_blocking(self.store.claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Claiming a job failed")
+                job = None
+            if job is not None:
+                await self.process(job)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _purge(self):
+        while True:
+            try:
+                await self.run_blocking(self.store.purge)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Purging finished jobs failed")
+            await asyncio.sleep(3600)
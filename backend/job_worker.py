@@ -0,0 +1,34 @@
+"""
+Runs queued lesson and quiz jobs without serving HTTP, so generation capacity can be
+scaled separately from the API. Point it at the API's job database:
+
+    JOB_WORKERS=0 uvicorn main:app          # API only enqueues
+    python job_worker.py --concurrency 4    # one or more of these do the generation
+"""
+import argparse
+import asyncio
+import logging
+
+from job_queue import JOB_WORKERS
+
+
+async def run(concurrency: int):
+    import main
+
+    worker = await main.start_job_worker(concurrency)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker.stop()
+        main.shutdown_executors(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process background generation jobs")
+    parser.add_argument("--concurrency", type=int, default=max(JOB_WORKERS, 1), help="jobs processed at once")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run(args.concurrency))
+    except KeyboardInterrupt:
+        pass
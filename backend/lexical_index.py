@@ -0,0 +1,132 @@
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Bump when tokenization changes so stored lexical indexes get rebuilt
+TOKENIZER_VERSION = 1
+# Keeps product and plan names such as "way2save", "401" or "ira" as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its me my of on or "
+    "so that the their them then there these they this to was we were what when which who why "
+    "will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def lexical_settings() -> dict:
+    return {"tokenizer": TOKENIZER_VERSION}
+
+
+class LexicalIndex:
+    """
+    Inverted index for BM25 scoring. Postings are stored CSR-style: the documents and
+    term frequencies for term t are doc_ids[offsets[t]:offsets[t + 1]] and the matching
+    slice of tfs, so the whole index is a handful of flat numpy arrays.
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self._term_ids: Dict[str, int] = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        term_ids: Dict[str, int] = {}
+        posting_terms, posting_docs, posting_tfs = array("i"), array("i"), array("f")
+        doc_lengths = array("i")
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                posting_docs.append(doc)
+                posting_tfs.append(tf)
+
+        posting_terms = np.frombuffer(posting_terms, dtype=np.int32)
+        # A stable sort keeps each term's postings in document order
+        order = np.argsort(posting_terms, kind="stable")
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(term_ids)), out=offsets[1:])
+        terms = np.array(list(term_ids), dtype=str) if term_ids else np.array([], dtype="<U1")
+        return cls(
+            terms,
+            offsets,
+            np.frombuffer(posting_docs, dtype=np.int32)[order],
+            np.frombuffer(posting_tfs, dtype=np.float32)[order],
+            np.frombuffer(doc_lengths, dtype=np.int32).copy(),
+        )
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, terms=self.terms, offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            return cls(data["terms"], data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"])
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+
+def bm25_search(
+    parts: Sequence[Tuple[LexicalIndex, int]],
+    query: str,
+    k: int,
+    exclude: FrozenSet[int] = frozenset(),
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+) -> List[int]:
+    """
+    Top-k document ids for the query by BM25. `parts` are (index, id offset) pairs, e.g.
+    the base index and the runtime delta, and are scored with shared corpus statistics.
+    """
+    terms = set(tokenize(query))
+    total_docs = sum(len(index) for index, _ in parts)
+    if not terms or not total_docs:
+        return []
+    avg_length = max(sum(float(index.doc_lengths.sum()) for index, _ in parts) / total_docs, 1.0)
+    size = max(offset + len(index) for index, offset in parts)
+    scores = np.zeros(size, dtype=np.float32)
+    matched = False
+    for term in terms:
+        postings = [(index.postings(term), index, offset) for index, offset in parts]
+        postings = [(p, index, offset) for p, index, offset in postings if p is not None]
+        df = sum(len(p[0]) for p, _, _ in postings)
+        if not df:
+            continue
+        matched = True
+        idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+        for (doc_ids, tfs), index, offset in postings:
+            norm = k1 * (1 - b + b * index.doc_lengths[doc_ids] / avg_length)
+            scores[doc_ids + offset] += idf * tfs * (k1 + 1) / (tfs + norm)
+    if not matched:
+        return []
+    if exclude:
+        scores[[i for i in exclude if i < size]] = 0
+    candidates = np.flatnonzero(scores)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
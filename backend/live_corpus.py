@@ -0,0 +1,134 @@
+import threading
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from doc_store import DocumentStore
+from ingest import ingest_file
+from lexical_index import LexicalIndex, bm25_search
+
+
+class _Snapshot(NamedTuple):
+    base_index: faiss.Index
+    base_store: DocumentStore
+    base_lexical: LexicalIndex
+    base_vectors: np.ndarray
+    delta_index: Optional[faiss.Index]
+    delta_documents: List[str]
+    delta_metadata: List[dict]
+    delta_lexical: Optional[LexicalIndex]
+    removed: FrozenSet[int]
+    sources: Dict[str, np.ndarray]
+
+
+class LiveCorpus:
+    """
+    The loaded index plus changes made while the service is running. Files added at
+    runtime go into a small exact "delta" index next to the read-only base index;
+    removed files are tombstoned and filtered out of results. Every change publishes a
+    new immutable snapshot, so searches never wait on ingestion. The next corpus build
+    folds these changes into the base index.
+    """
+
+    def __init__(self, index: faiss.Index, store: DocumentStore, lexical: LexicalIndex, vectors: np.ndarray):
+        sources = {source: store.ids_for_source(source) for source in store.sources}
+        self._snapshot = _Snapshot(index, store, lexical, vectors, None, [], [], None, frozenset(), sources)
+        self._write_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        snapshot = self._snapshot
+        total = snapshot.base_index.ntotal + len(snapshot.delta_documents)
+        return total - len(snapshot.removed)
+
+    def text(self, i: int) -> str:
+        snapshot = self._snapshot
+        offset = len(snapshot.base_store)
+        return snapshot.base_store[i] if i < offset else snapshot.delta_documents[i - offset]
+
+    def metadata(self, i: int) -> dict:
+        snapshot = self._snapshot
+        offset = len(snapshot.base_store)
+        return snapshot.base_store.metadata(i) if i < offset else snapshot.delta_metadata[i - offset]
+
+    def vectors(self, ids: Sequence[int]) -> np.ndarray:
+        # Stored chunk embeddings, so callers never re-encode retrieved chunks
+        snapshot = self._snapshot
+        offset = len(snapshot.base_store)
+        rows = [snapshot.base_vectors[i] if i < offset else snapshot.delta_index.reconstruct(i - offset) for i in ids]
+        return np.asarray(rows, dtype="float32").reshape(len(ids), snapshot.base_index.d)
+
+    def sources(self) -> List[str]:
+        return sorted(self._snapshot.sources)
+
+    def search(self, vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        snapshot = self._snapshot
+        if snapshot.delta_index is None and not snapshot.removed:
+            return snapshot.base_index.search(vectors, k)
+
+        # Over-fetch by the number of tombstones so k live results survive the filter
+        fetch = min(k + len(snapshot.removed), max(snapshot.base_index.ntotal, 1))
+        distances, ids = snapshot.base_index.search(vectors, fetch)
+        if snapshot.delta_index is not None and snapshot.delta_index.ntotal:
+            delta_fetch = min(k + len(snapshot.removed), snapshot.delta_index.ntotal)
+            delta_distances, delta_ids = snapshot.delta_index.search(vectors, delta_fetch)
+            delta_ids = np.where(delta_ids >= 0, delta_ids + len(snapshot.base_store), -1)
+            distances = np.hstack([distances, delta_distances])
+            ids = np.hstack([ids, delta_ids])
+
+        out_distances = np.full((len(vectors), k), np.inf, dtype="float32")
+        out_ids = np.full((len(vectors), k), -1, dtype="int64")
+        for row in range(len(vectors)):
+            hits = [(d, i) for d, i in zip(distances[row], ids[row]) if i >= 0 and i not in snapshot.removed]
+            hits.sort()
+            for col, (d, i) in enumerate(hits[:k]):
+                out_distances[row, col] = d
+                out_ids[row, col] = i
+        return out_distances, out_ids
+
+    def lexical_search(self, query: str, k: int) -> List[int]:
+        snapshot = self._snapshot
+        parts = [(snapshot.base_lexical, 0)]
+        if snapshot.delta_lexical is not None:
+            parts.append((snapshot.delta_lexical, len(snapshot.base_store)))
+        return bm25_search(parts, query, k, snapshot.removed)
+
+    def add_file(self, path: str, source: str, sentence_model, pool=None) -> int:
+        # Extraction and embedding happen before taking the lock; only the swap is serialized
+        chunks, chunk_metadata, vectors = ingest_file(path, source, sentence_model, pool)
+        with self._write_lock:
+            snapshot = self._snapshot
+            previous_ids = snapshot.sources.get(source)
+            removed = snapshot.removed | frozenset(previous_ids.tolist() if previous_ids is not None else ())
+
+            delta_index = faiss.IndexFlatL2(vectors.shape[1] if len(vectors) else snapshot.base_index.d)
+            if snapshot.delta_index is not None and snapshot.delta_index.ntotal:
+                delta_index.add(snapshot.delta_index.reconstruct_n(0, snapshot.delta_index.ntotal))
+            start = len(snapshot.base_store) + len(snapshot.delta_documents)
+            if len(vectors):
+                delta_index.add(vectors)
+
+            sources = dict(snapshot.sources)
+            sources[source] = np.arange(start, start + len(chunks))
+            delta_documents = snapshot.delta_documents + chunks
+            self._snapshot = snapshot._replace(
+                delta_index=delta_index,
+                delta_documents=delta_documents,
+                delta_metadata=snapshot.delta_metadata + chunk_metadata,
+                delta_lexical=LexicalIndex.build(delta_documents),
+                removed=removed,
+                sources=sources,
+            )
+        return len(chunks)
+
+    def remove_file(self, source: str) -> int:
+        with self._write_lock:
+            snapshot = self._snapshot
+            ids = snapshot.sources.get(source)
+            if ids is None:
+                return 0
+            sources = dict(snapshot.sources)
+            del sources[source]
+            self._snapshot = snapshot._replace(removed=snapshot.removed | frozenset(ids.tolist()), sources=sources)
+        return len(ids)
@@ -1,50 +1,86 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+from contextlib import asynccontextmanager
 import os
+import hmac
+import logging
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
-import google.generativeai as genai
-import PyPDF2
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 import json
+import asyncio
+import time
+import re
+from datetime import timedelta
+from generation import LLM_TIMEOUT, GenerationPipeline
+from executors import run_embedding, run_db, run_ingest, run_llm, shutdown_executors
+from response_cache import ResponseCache, RedisBackend
+from embedding_batcher import EmbeddingBatcher
+from hybrid_retriever import HybridRetriever, load_reranker
+from context_builder import CONTEXT_BUDGETING, ContextBuilder, context_budget
+from recommender import ServiceRecommender
+from question_bank import GAME_TOPIC, MAX_QUIZ_QUESTIONS, GeneratedQuestion, QuestionBank, RefillWorker, normalize_topic, parse_questions
+from structured_output import STRUCTURED_OUTPUT, as_list, extract_json, fill_missing, json_output_config
+from job_queue import JOB_WORKERS, JobStore, JobWorker
+from user_store import USER_STORE_BACKEND, create_user_store
+from resources import LazyResource
+from embedding_backend import load_sentence_model
+import instrumentation
+from instrumentation import count_cache, count_tokens, estimate_tokens, span
 
 # Load environment variables
 load_dotenv()
 
-# Firebase setup
-relative_json_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
+logger = logging.getLogger(__name__)
 current_directory = os.path.dirname(os.path.abspath(__file__))
-json_path = os.path.join(current_directory, relative_json_path)
-cred = credentials.Certificate(json_path)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+
+# Heavy clients and models are created on first use (or by the background warm-up),
+# so importing this module stays fast and has no side effects
+
+# Firebase setup
+def create_users():
+    db = None
+    if USER_STORE_BACKEND == "firestore":
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        relative_json_path = os.getenv("FIREBASE_CREDENTIALS_PATH")
+        json_path = os.path.join(current_directory, relative_json_path)
+        cred = credentials.Certificate(json_path)
+        firebase_admin.initialize_app(cred)
+        db = firestore.client()
+    return create_user_store(db)
+
+user_store = LazyResource("user store", create_users)
 
 # Gemini AI setup
-genai.configure(api_key=os.getenv("API_KEY"))
-model = genai.GenerativeModel("gemini-1.5-flash")
-
-# FastAPI app setup
-app = FastAPI()
-
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Your React app's URL
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all methods (GET, POST, etc.)
-    allow_headers=["*"],  # Allow all headers
-)
+def create_gemini_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("API_KEY"))
+    return genai.GenerativeModel("gemini-1.5-flash")
+
+gemini = LazyResource("gemini", create_gemini_model)
 
 # Sentence Transformer and FAISS setup
-sentence_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-embedding_size = sentence_model.get_sentence_embedding_dimension()
-index = faiss.IndexFlatL2(embedding_size)
-documents = []
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(current_directory, "data"))
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(current_directory, "index_cache"))
+# Admin routes are disabled until a token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# PDFs removed through the admin API are moved here, outside the indexed directory
+REMOVED_DIR = os.getenv("REMOVED_DIR", os.path.join(DATA_DIR, "removed"))
+# Set to false to load models on first use only, e.g. for `uvicorn --reload` while working on other routes
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+
+# EMBEDDING_BACKEND picks PyTorch or ONNX Runtime (optionally int8); see embedding_backend.py
+sentence_model = LazyResource("embedding model", lambda: load_sentence_model(EMBEDDING_MODEL))
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    with span("embed"):
+        return sentence_model.get().encode(texts, normalize_embeddings=True)
 
 # Model classes
 class LoginInfo(BaseModel):
@@ -87,16 +123,32 @@ class SubtopicsRequest(BaseModel):
 class QuizRequest(BaseModel):
     topic: str
     difficulty: int
-    num_questions: int
+    num_questions: int = Field(ge=1, le=MAX_QUIZ_QUESTIONS)
+    userId: Optional[str] = None
 
 class GameRequest(BaseModel):
     level: int
-    num_questions: int
+    num_questions: int = Field(ge=1, le=MAX_QUIZ_QUESTIONS)
+    userId: Optional[str] = None
 
 class ChatRequest(BaseModel):
     question: str
     k: int = 5
 
+class SubtopicsResponse(BaseModel):
+    subtopics: List[str]
+
+class QuizQuestion(BaseModel):
+    id: int
+    question: str
+    options: List[str]
+    correct: int
+
+class QuizResponse(BaseModel):
+    topic: str
+    difficulty: int
+    questions: List[QuizQuestion]
+
 # Wells Fargo services data
 wells_fargo_services = [
     {
@@ -219,214 +271,761 @@ wells_fargo_services = [
 ]
 
 # Helper functions
-def load_documents():
-    global documents
-    for file in os.listdir("Data"):
-        if file.lower().endswith('.pdf'):
-            with open(os.path.join("Data", file), "rb") as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                for page in pdf_reader.pages:
-                    documents.append(page.extract_text())
-
-def initialize_index():
-    load_documents()
-    document_embeddings = sentence_model.encode(documents)
-    index.add(document_embeddings)
+def load_corpus():
+    # Loads the prebuilt artifact from INDEX_DIR, re-chunking and re-embedding only PDFs that changed
+    from corpus_index import load_or_build_index
+    from ann_index import configure_search
+    from live_corpus import LiveCorpus
+
+    index, store, lexical, vectors = load_or_build_index(DATA_DIR, INDEX_DIR, sentence_model.get(), EMBEDDING_MODEL)
+    configure_search(index)
+    return LiveCorpus(index, store, lexical, vectors)
+
+corpus = LazyResource("corpus index", load_corpus)
+
+# Vector hits fused with BM25 hits, optionally re-ranked by a cross-encoder
+retriever = LazyResource("retriever", lambda: HybridRetriever(reranker=load_reranker()))
 
 def retrieve_relevant_content(query: str, k: int = 10) -> List[str]:
-    query_embedding = sentence_model.encode([query])
-    _, indices = index.search(query_embedding, k)
-    return [documents[i] for i in indices[0]]
+    live_corpus, hybrid = corpus.get(), retriever.get()
+    with span("retrieve"):
+        with span("embed"):
+            query_embedding = sentence_model.get().encode([query])
+        with span("index_search"):
+            _, indices = live_corpus.search(query_embedding, hybrid.candidate_count(k))
+        # FAISS pads with -1 when k exceeds the number of chunks
+        ids = hybrid.combine(live_corpus, query, [int(i) for i in indices[0] if i >= 0], k)
+        return [live_corpus.text(i) for i in ids]
 
-def call_gemini_api(prompt: str) -> str:
-    response = model.generate_content(prompt)
+# Concurrent route queries are encoded and searched together in small batches
+retrieval_batcher = EmbeddingBatcher(
+    encode=lambda texts: sentence_model.get().encode(texts),
+    search=lambda vectors, k: corpus.get().search(vectors, k),
+)
+
+# Clients pick k for /chat; anything above this only adds prompt tokens
+MAX_RETRIEVAL_K = int(os.getenv("MAX_RETRIEVAL_K", "20"))
+
+async def retrieve(query: str, k: int = 10) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    # Returns the chunk texts, their stored embeddings and the query vector
+    live_corpus, hybrid = await corpus.aget(), await retriever.aget()
+    k = max(1, min(k, MAX_RETRIEVAL_K))
+    with span("retrieve"):
+        ids, query_vector = await retrieval_batcher.query_with_vector(query, hybrid.candidate_count(k))
+        ids = await run_embedding(hybrid.combine, live_corpus, query, ids, k)
+        return [live_corpus.text(i) for i in ids], live_corpus.vectors(ids), query_vector
+
+# Retrieved chunks are deduplicated, diversified and trimmed to the endpoint's token budget
+context_builder = ContextBuilder(encode=lambda texts: sentence_model.get().encode(texts))
+
+async def retrieve_context(query: str, endpoint: str, k: int = 10) -> str:
+    chunks, chunk_vectors, query_vector = await retrieve(query, k)
+    if not CONTEXT_BUDGETING:
+        return "\n\n".join(chunks)
+    with span("context"):
+        return await run_embedding(context_builder.build, query_vector, chunks, context_budget(endpoint), chunk_vectors)
+
+def count_llm_tokens(prompt: str, text: str, usage=None):
+    # Gemini reports exact counts in usage_metadata; estimate when it doesn't
+    count_tokens("prompt", getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt))
+    count_tokens("response", getattr(usage, "candidates_token_count", 0) or estimate_tokens(text))
+
+def generate_with(llm, prompt: str, **kwargs) -> str:
+    with span("llm"):
+        # The SDK deadline ends the request itself; the pipeline's wait_for only stops waiting on it
+        response = llm.generate_content(prompt, request_options={"timeout": LLM_TIMEOUT}, **kwargs)
+    count_llm_tokens(prompt, response.text, getattr(response, "usage_metadata", None))
     return response.text
 
-# Initialize index on startup
-initialize_index()
+def call_gemini_api(prompt: str) -> str:
+    return generate_with(gemini.get(), prompt)
+
+def structured_llm(output_type):
+    # call_llm that has Gemini constrain its reply to output_type's JSON schema
+    if not STRUCTURED_OUTPUT:
+        return None
+    config = json_output_config(output_type)
+    return lambda prompt: generate_with(gemini.get(), prompt, generation_config=config)
+
+def stream_gemini_api(prompt: str) -> Iterator[str]:
+    with span("llm_stream"):
+        started = time.perf_counter()
+        parts, usage = [], None
+        for chunk in gemini.get().generate_content(prompt, stream=True, request_options={"timeout": LLM_TIMEOUT}):
+            if not parts:
+                first_chunk = time.perf_counter() - started
+                instrumentation.observe("llm_first_chunk", first_chunk)
+                instrumentation.add_to_trace("llm_first_chunk", first_chunk)
+            parts.append(chunk.text)
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk.text
+    count_llm_tokens(prompt, "".join(parts), usage)
+
+# Concurrency-limited, retrying wrapper around call_gemini_api for async routes
+llm_pipeline = GenerationPipeline(call_gemini_api, stream_gemini_api)
+
+# Exact + semantic cache in front of the LLM for repeated topics and questions
+def embed_for_cache(text: str) -> np.ndarray:
+    return embed_texts([text])[0]
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+redis_url = os.getenv("RESPONSE_CACHE_REDIS_URL")
+response_cache = ResponseCache(embed=embed_for_cache, shared_backend=RedisBackend(redis_url) if redis_url else None)
+inflight_generations = {}
+
+async def build_prompt(prompt_factory) -> str:
+    # Prompt assembly includes retrieval, which is also traced on its own
+    with span("prompt"):
+        return await prompt_factory()
+
+async def cached_generate(namespace: str, key: str, prompt_factory, semantic: bool = True, call_llm=None) -> str:
+    if not RESPONSE_CACHE_ENABLED:
+        return await llm_pipeline.generate(await build_prompt(prompt_factory), call_llm)
+    with span("cache_lookup"):
+        cached, key_vector = await run_embedding(response_cache.lookup, namespace, key, semantic)
+    count_cache("response", hit=cached is not None)
+    if cached is not None:
+        return cached
+    # Identical concurrent misses share one LLM call
+    inflight_key = (namespace, key)
+    if inflight_key in inflight_generations:
+        return await asyncio.shield(inflight_generations[inflight_key])
+
+    async def produce() -> str:
+        response = await llm_pipeline.generate(await build_prompt(prompt_factory), call_llm)
+        await run_embedding(response_cache.set, namespace, key, response, semantic, key_vector)
+        return response
+
+    task = asyncio.ensure_future(produce())
+    inflight_generations[inflight_key] = task
+    try:
+        return await asyncio.shield(task)
+    finally:
+        inflight_generations.pop(inflight_key, None)
+
+def ndjson_event(**event) -> str:
+    return json.dumps(event) + "\n"
+
+async def stream_llm_events(prompt_factory) -> AsyncIterator[str]:
+    # Streams Gemini tokens as NDJSON events; failures are reported in-band since headers are already sent
+    try:
+        prompt = await build_prompt(prompt_factory)
+        async for text in llm_pipeline.stream(prompt):
+            yield ndjson_event(type="token", text=text)
+    except Exception as e:
+        yield ndjson_event(type="error", detail=str(e))
+        return
+    yield ndjson_event(type="done")
+
+router = APIRouter()
 
 # API routes
-@app.get("/")
+@router.get("/")
 async def get_home():
     return {"message": "Welcome to the Educational and Financial Advice Service!"}
 
-@app.post("/api/login")
+@router.get("/healthz")
+async def liveness():
+    # The process is up and serving; says nothing about models
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness():
+    # Ready once everything RAG routes need is loaded; non-RAG routes work before that
+    resources = {resource.name: resource.status() for resource in (sentence_model, corpus, retriever, recommender)}
+    ready = all(status["ready"] for status in resources.values())
+    return JSONResponse({"ready": ready, "resources": resources}, status_code=200 if ready else 503)
+
+# Refreshed off the event loop by /metrics just before rendering; collectors must not query SQLite
+job_counts: dict = {}
+
+def collect_app_metrics():
+    for kind, value in response_cache.stats.items():
+        yield "response_cache_lookups", "Response cache lookups by outcome since start", {"outcome": kind}, value
+    yield "response_cache_generations_inflight", "LLM generations shared by concurrent cache misses", {}, len(inflight_generations)
+    if user_store.ready:
+        for kind, value in user_store.get().stats.items():
+            yield "profile_cache_events", "Profile cache hits, misses and invalidations since start", {"event": kind}, value
+    for kind, value in context_builder.stats.items():
+        yield "context_builder_totals", "Chunks and estimated tokens seen and kept by context budgeting since start", {"kind": kind}, value
+    for status, count in job_counts.items():
+        yield "jobs", "Background jobs by status", {"status": status}, count
+    for resource in (user_store, gemini, sentence_model, corpus, retriever, recommender, question_bank, job_store):
+        yield "resource_ready", "1 once a lazily loaded resource is ready", {"resource": resource.name}, int(resource.ready)
+
+instrumentation.registry.add_collector(collect_app_metrics)
+
+@router.get("/metrics")
+async def metrics():
+    if not instrumentation.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    if job_store.ready:
+        # Statuses with no jobs left drop to 0 instead of disappearing
+        job_counts.update(dict.fromkeys(job_counts, 0))
+        job_counts.update(await run_db(job_store.get().counts))
+    return PlainTextResponse(instrumentation.registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.post("/api/login")
 async def login(login_info: LoginInfo):
     try:
-        new_doc_ref = db.collection('users').document()
-        new_doc_ref.set({
+        user_id = await run_db((await user_store.aget()).create, {
             "username": login_info.username,
             "password": login_info.password,  # Note: Storing passwords in plaintext is not secure. Use hashing in production.
             "additional_info": False
         })
         return {
             "message": f"User {login_info.username} logged in successfully.",
-            "documentId": new_doc_ref.id,
-            "url": f"http://localhost:3000/complete-profile-info/{new_doc_ref.id}"
+            "documentId": user_id,
+            "url": f"http://localhost:3000/complete-profile-info/{user_id}"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/complete-profile-info/{user_id}")
+@router.post("/api/complete-profile-info/{user_id}")
 async def complete_profile_info(user_id: str, person_info: PersonInfo):
     try:
-        doc_ref = db.collection('users').document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
         update_data = person_info.model_dump()
         update_data['additional_info'] = True
-        doc_ref.update(update_data)
+        if not await run_db((await user_store.aget()).update, user_id, update_data):
+            raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
         return {
             "message": f"Profile for user {user_id} updated successfully.",
             "documentId": user_id
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/store-topic")
+@router.post("/api/store-topic")
 async def store_topic(request: TopicRequest):
     try:
-        doc_ref = db.collection('users').document(request.userId)
-        doc = doc_ref.get()
-        if not doc.exists:
+        if not await run_db((await user_store.aget()).update, request.userId, {"topic": request.topic}):
             raise HTTPException(status_code=404, detail="User not found")
-        doc_ref.update({"topic": request.topic})
         return {"message": "Topic stored successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/get-age/{user_id}")
+@router.get("/api/get-age/{user_id}")
 async def get_age(user_id: str):
     try:
-        doc_ref = db.collection('users').document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
+        profile = await run_db((await user_store.aget()).get, user_id, ["age"])
+        if profile is None:
             raise HTTPException(status_code=404, detail="User not found")
-        age = doc.to_dict().get("age")
-        return {"age": age}
+        return {"age": profile.get("age")}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_subtopics")
-async def generate_subtopics(request: SubtopicsRequest):
-    query = f"Information about {request.topic} suitable for {request.age} year olds"
-    relevant_contents = retrieve_relevant_content(query)
-    relevant_content = "\n\n".join(relevant_contents)
+SUBTOPIC_COUNT = 10
+SUBTOPIC_PREFIX = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+
+def parse_subtopics(raw: str) -> List[str]:
+    try:
+        items = as_list(extract_json(raw))
+    except ValueError:
+        # Plain-text replies (cached before JSON output, or a model ignoring it) have one per line
+        items = raw.split("\n")
+    subtopics, seen = [], set()
+    for item in items:
+        if not isinstance(item, str):
+            continue
+        subtopic = SUBTOPIC_PREFIX.sub("", item).strip()
+        if not subtopic or subtopic.startswith("Topic:") or subtopic.lower() in seen:
+            continue
+        seen.add(subtopic.lower())
+        subtopics.append(subtopic)
+    return subtopics
+
+async def more_subtopics(request: SubtopicsRequest, have: List[str], missing: int) -> List[str]:
     prompt = f"""
-    You are an expert educator. Generate a list of 10 subtopics for a comprehensive lesson on '{request.topic}' for a person who is {request.age} years old.
+    Suggest {missing} more subtopics for a lesson on '{request.topic}' for a person who is {request.age} years old.
+    They must be different from these: {json.dumps(have)}
+    Respond with only a JSON array of strings.
+    """
+    known = {subtopic.lower() for subtopic in have}
+    raw = await llm_pipeline.generate(prompt, structured_llm(List[str]))
+    return [subtopic for subtopic in parse_subtopics(raw) if subtopic.lower() not in known]
+
+async def build_subtopics_prompt(request: SubtopicsRequest) -> str:
+    query = f"Information about {request.topic} suitable for {request.age} year olds"
+    relevant_content = await retrieve_context(query, "subtopics")
+    return f"""
+    You are an expert educator. Generate a list of {SUBTOPIC_COUNT} subtopics for a comprehensive lesson on '{request.topic}' for a person who is {request.age} years old.
     Use the following relevant information to inform your subtopic selection:
 
     {relevant_content}
 
-    Provide the subtopics as a numbered list, ensuring they cover the topic thoroughly and are age-appropriate.
+    Respond with only a JSON array of {SUBTOPIC_COUNT} strings, one subtopic each, ensuring they cover the topic thoroughly and are age-appropriate.
     """
-    subtopics_response = call_gemini_api(prompt)
-    subtopics = [line.strip() for line in subtopics_response.split('\n') if line.strip() and not line.strip().startswith('Topic:')]
+
+def ingest_corpus_file(path: str, file_name: str) -> int:
+    from ingest import create_extraction_pool
+
+    pool = create_extraction_pool()
+    try:
+        return corpus.get().add_file(path, file_name, sentence_model.get(), pool)
+    finally:
+        pool.shutdown()
+
+def remove_corpus_document(file_name: str) -> Optional[int]:
+    # Tombstoned for this worker right away; with the PDF out of DATA_DIR, the next
+    # load_or_build_index sees the changed file list and builds without it
+    removed = corpus.get().remove_file(file_name)
+    path = os.path.join(DATA_DIR, file_name)
+    moved = os.path.isfile(path)
+    if moved:
+        os.makedirs(REMOVED_DIR, exist_ok=True)
+        os.replace(path, os.path.join(REMOVED_DIR, file_name))
+    if not removed and not moved:
+        return None
+    return removed
+
+def check_admin_token(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin routes are disabled; set ADMIN_TOKEN")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.get("/admin/corpus")
+async def list_corpus_files(x_admin_token: Optional[str] = Header(None)):
+    check_admin_token(x_admin_token)
+    live_corpus = await corpus.aget()
+    return {"files": live_corpus.sources(), "chunks": live_corpus.size}
+
+@router.post("/admin/corpus/{file_name}")
+async def add_corpus_file(file_name: str, x_admin_token: Optional[str] = Header(None)):
+    # Indexes a PDF already placed in DATA_DIR (or re-indexes it after an update) without a restart
+    check_admin_token(x_admin_token)
+    file_name = os.path.basename(file_name)
+    path = os.path.join(DATA_DIR, file_name)
+    if not file_name.lower().endswith(".pdf") or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"{file_name} not found in data directory")
+    chunks = await run_ingest(ingest_corpus_file, path, file_name)
+    return {"message": f"Indexed {file_name}", "chunks": chunks}
+
+@router.delete("/admin/corpus/{file_name}")
+async def remove_corpus_file(file_name: str, x_admin_token: Optional[str] = Header(None)):
+    # Moves the PDF to REMOVED_DIR, so the removal survives restarts without rebuilding now.
+    # Only this worker stops serving it right away; other workers drop it when they restart.
+    check_admin_token(x_admin_token)
+    file_name = os.path.basename(file_name)
+    await corpus.aget()
+    removed = await run_ingest(remove_corpus_document, file_name)
+    if removed is None:
+        raise HTTPException(status_code=404, detail=f"{file_name} is not indexed")
+    return {"message": f"Removed {file_name} from the index", "chunks": removed}
+
+@router.post("/generate_subtopics", response_model=SubtopicsResponse)
+async def generate_subtopics(request: SubtopicsRequest):
+    namespace = f"subtopics:age={request.age}"
+    raw = await cached_generate(namespace, request.topic, lambda: build_subtopics_prompt(request), call_llm=structured_llm(List[str]))
+    subtopics = parse_subtopics(raw)[:SUBTOPIC_COUNT]
+    if len(subtopics) < SUBTOPIC_COUNT:
+        # Ask only for the missing subtopics, then cache the repaired list so later hits skip the repair
+        subtopics = await fill_missing(subtopics, SUBTOPIC_COUNT, lambda have, missing: more_subtopics(request, have, missing))
+        if RESPONSE_CACHE_ENABLED and subtopics:
+            await run_embedding(response_cache.set, namespace, request.topic, json.dumps(subtopics))
     return {"subtopics": subtopics}
 
-@app.post("/generate_lesson")
+async def build_lesson_section_prompt(subtopic: str, topic: str, age: int) -> str:
+    query = f"Information about {subtopic} related to {topic} suitable for {age} year olds"
+    relevant_content = await retrieve_context(query, "lesson")
+    return f"""
+    You are an expert educator. Create a detailed lesson on the subtopic '{subtopic}' as part of the main topic '{topic}' for a person who is {age} years old.
+    Use the following relevant information to enhance your lesson:
+
+    {relevant_content}
+
+    Make the lesson age-appropriate, engaging, and easy to understand. Include explanations of any specific terms used.
+    Structure this part of the lesson with an introduction, main content, and a brief conclusion.
+    """
+
+async def generate_lesson_section(subtopic: str, topic: str, age: int) -> str:
+    prompt = await build_lesson_section_prompt(subtopic, topic, age)
+    subtopic_content = await llm_pipeline.generate(prompt)
+    return f"## {subtopic}\n\n{subtopic_content}"
+
+@router.post("/generate_lesson")
 async def generate_lesson(request: LessonRequest):
     subtopics_request = SubtopicsRequest(topic=request.topic, age=request.age)
     subtopics_response = await generate_subtopics(subtopics_request)
     subtopics = subtopics_response["subtopics"]
 
-    full_lesson = []
-    for subtopic in subtopics:
-        query = f"Information about {subtopic} related to {request.topic} suitable for {request.age} year olds"
-        relevant_contents = retrieve_relevant_content(query)
-        relevant_content = "\n\n".join(relevant_contents)
-        prompt = f"""
-        You are an expert educator. Create a detailed lesson on the subtopic '{subtopic}' as part of the main topic '{request.topic}' for a person who is {request.age} years old.
-        Use the following relevant information to enhance your lesson:
-
-        {relevant_content}
-
-        Make the lesson age-appropriate, engaging, and easy to understand. Include explanations of any specific terms used.
-        Structure this part of the lesson with an introduction, main content, and a brief conclusion.
-        """
-        subtopic_content = call_gemini_api(prompt)
-        full_lesson.append(f"## {subtopic}\n\n{subtopic_content}")
-    
+    # All subtopic sections are generated concurrently, results stay in subtopic order
+    full_lesson = await llm_pipeline.map(
+        lambda subtopic: generate_lesson_section(subtopic, request.topic, request.age),
+        subtopics,
+    )
+
     complete_lesson = "\n\n".join(full_lesson)
     return {"subtopics": subtopics, "complete_lesson": complete_lesson}
 
-@app.post("/recommend")
-async def recommend_service(request: RecommendationRequest):
-    service_details = "\n".join([f"- **{service['name']}**: {service['description']}" for service in wells_fargo_services])
-    prompt = (
-        f"You are an expert financial advisor. Given the following information, "
-        f"provide a personalized recommendation based on available services:\n\n"
+async def lesson_events(request: LessonRequest) -> AsyncIterator[str]:
+    try:
+        subtopics_response = await generate_subtopics(SubtopicsRequest(topic=request.topic, age=request.age))
+    except Exception as e:
+        yield ndjson_event(type="error", detail=str(e))
+        return
+    subtopics = subtopics_response["subtopics"]
+    yield ndjson_event(type="subtopics", subtopics=subtopics)
+
+    async def indexed_section(i: int, subtopic: str):
+        return i, subtopic, await generate_lesson_section(subtopic, request.topic, request.age)
+
+    # Sections are sent as soon as each one finishes; clients reassemble them by index
+    tasks = [asyncio.create_task(indexed_section(i, subtopic)) for i, subtopic in enumerate(subtopics)]
+    try:
+        for next_section in asyncio.as_completed(tasks):
+            i, subtopic, content = await next_section
+            yield ndjson_event(type="section", index=i, subtopic=subtopic, content=content)
+    except Exception as e:
+        yield ndjson_event(type="error", detail=str(e))
+        return
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield ndjson_event(type="done")
+
+@router.post("/generate_lesson/stream")
+async def generate_lesson_stream(request: LessonRequest):
+    return StreamingResponse(lesson_events(request), media_type="application/x-ndjson")
+
+# Recommendation engine: service descriptions are embedded once and shortlisted per request
+recommender = LazyResource("recommender", lambda: ServiceRecommender(wells_fargo_services, embed=embed_texts))
+
+RECOMMEND_INSTRUCTIONS = (
+    "You are an expert financial advisor. Given a customer's profile and a shortlist of "
+    "Wells Fargo services, provide a personalized recommendation on the most suitable "
+    "service(s) and explain briefly why they fit."
+)
+service_catalog = "\n".join([f"- **{service['name']}**: {service['description']}" for service in wells_fargo_services])
+
+# Optional Gemini context cache holding the instructions and full catalog as a reusable prefix
+RECOMMEND_CONTEXT_CACHE = os.getenv("RECOMMEND_CONTEXT_CACHE", "false").lower() == "true"
+RECOMMEND_CACHE_MODEL = os.getenv("RECOMMEND_CACHE_MODEL", "models/gemini-1.5-flash-001")
+RECOMMEND_CACHE_TTL = int(os.getenv("RECOMMEND_CACHE_TTL", "3600"))
+recommend_cached_model = {"model": None, "expires_at": 0.0}
+
+def get_recommendation_model():
+    if not RECOMMEND_CONTEXT_CACHE:
+        return None
+    now = time.time()
+    if now < recommend_cached_model["expires_at"] - 300:
+        return recommend_cached_model["model"]
+    import google.generativeai as genai
+    from google.generativeai import caching
+
+    try:
+        cached_content = caching.CachedContent.create(
+            model=RECOMMEND_CACHE_MODEL,
+            system_instruction=RECOMMEND_INSTRUCTIONS,
+            contents=[f"Here are the available services:\n{service_catalog}"],
+            ttl=timedelta(seconds=RECOMMEND_CACHE_TTL),
+        )
+        recommend_cached_model["model"] = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+    except Exception:
+        # Caching is unavailable (e.g. prefix below the model's minimum size); retry after the TTL
+        recommend_cached_model["model"] = None
+    recommend_cached_model["expires_at"] = now + RECOMMEND_CACHE_TTL
+    return recommend_cached_model["model"]
+
+def profile_details(request: RecommendationRequest) -> str:
+    return (
         f"Age: {request.age}\n"
         f"Credit Score: {request.credit_score}\n"
         f"Country: {request.country}\n"
         f"Occupation: {request.occupation}\n"
         f"Monthly Income: {request.monthly_income}\n"
-        f"Monthly Expenses: {request.monthly_expenses}\n\n"
-        f"Here are the available services:\n"
-        f"{service_details}\n\n"
-        f"Provide a personalized recommendation on the most suitable service(s) from the above list."
+        f"Monthly Expenses: {request.monthly_expenses}\n"
     )
-    response = call_gemini_api(prompt)
-    return {"recommendation": response}
 
-@app.post("/generate_quiz")
-async def generate_quiz_route(request: QuizRequest):
-    query = f"Information about {request.topic} for creating a quiz"
-    relevant_contents = retrieve_relevant_content(query)
-    relevant_content = "\n\n".join(relevant_contents)
-    prompt = f"""
-    You are an expert educator. Create a quiz on the topic of '{request.topic}' with the following specifications:
-    - Difficulty level: {request.difficulty}/9
-    - Number of questions: {request.num_questions}
+@router.post("/recommend")
+async def recommend_service(request: RecommendationRequest):
+    service_recommender = await recommender.aget()
+    ranked = await run_embedding(service_recommender.rank, request)
+    if service_recommender.is_low_stakes(request, ranked):
+        return {"recommendation": service_recommender.fast_recommendation(ranked)}
 
-    Use the following relevant information to create accurate and engaging questions:
+    cached_model = await run_llm(get_recommendation_model)
+    call_llm = (lambda prompt: generate_with(cached_model, prompt)) if cached_model else None
+    response = await cached_generate(
+        "recommend", request.model_dump_json(), lambda: build_recommendation_prompt(request, ranked, cached_model is not None),
+        semantic=False, call_llm=call_llm,
+    )
+    return {"recommendation": response}
 
-    {relevant_content}
+async def build_recommendation_prompt(request: RecommendationRequest, ranked, catalog_cached: bool = False) -> str:
+    if catalog_cached:
+        # The catalog is already in the cached prefix, so only name the shortlist
+        shortlist = "\n".join(f"- {item.service['name']}" for item in ranked)
+        return f"Customer profile:\n{profile_details(request)}\nShortlisted services:\n{shortlist}"
+    service_details = "\n".join(f"- **{item.service['name']}**: {item.service['description']}" for item in ranked)
+    return (
+        f"{RECOMMEND_INSTRUCTIONS}\n\n"
+        f"Customer profile:\n{profile_details(request)}\n"
+        f"Shortlisted services:\n{service_details}\n\n"
+        f"Provide a personalized recommendation on the most suitable service(s) from the above list."
+    )
 
-    Each question should have 4 answer options and indicate the correct answer.
-    Make sure the questions are appropriate for the specified difficulty level.
+QUESTION_FORMAT = """
+    Respond with only a JSON array. Each element must be an object with the keys
+    "question" (string), "options" (array of exactly 4 distinct strings) and
+    "correct" (the 0-based index of the correct option).
     """
-    quiz = call_gemini_api(prompt)
-    return {"quiz": quiz}
 
-@app.post("/generate_game")
-async def generate_game(request: GameRequest):
-    prompt = f"""
-    You are an expert educator in finance. Create a quiz with the following specifications:
-    - Number of questions: {request.num_questions}
-    - Difficulty level: {request.level}
+async def build_bank_questions_prompt(topic: str, difficulty: int, count: int) -> str:
+    if topic == GAME_TOPIC:
+        return f"""
+    You are an expert educator in finance. Create {count} multiple-choice questions at difficulty level {difficulty}.
     Total no of levels is from 0 to 9
-    
+
     The questions should cover various finance concepts randomly, such as:
     - Financial markets
     - Investment strategies
     - Risk management
     - Corporate finance
     - Personal finance
+    {QUESTION_FORMAT}"""
+    relevant_content = await retrieve_context(f"Information about {topic} for creating a quiz", "quiz")
+    return f"""
+    You are an expert educator. Create {count} multiple-choice questions on the topic of '{topic}' at difficulty level {difficulty}/9.
 
-    Each question should have 4 answer options and indicate the correct answer.
-    Ensure that the questions are different for each generation.
-    """
-    quiz = call_gemini_api(prompt)
-    return {"quiz": quiz}
+    Use the following relevant information to create accurate and engaging questions:
 
-@app.post("/chat")
-async def chat(request: ChatRequest):
-    relevant_contents = retrieve_relevant_content(request.question, k=request.k)
-    prompt = f"""
+    {relevant_content}
+    {QUESTION_FORMAT}"""
+
+async def generate_bank_questions(topic: str, difficulty: int, count: int):
+    call_llm = structured_llm(List[GeneratedQuestion])
+    raw = await llm_pipeline.generate(await build_bank_questions_prompt(topic, difficulty, count), call_llm)
+
+    # Items that failed validation are replaced by asking for just that many more
+    async def more_questions(have, missing: int):
+        prompt = await build_bank_questions_prompt(topic, difficulty, missing)
+        if have:
+            prompt += "\n    Do not repeat any of these questions:\n" + "\n".join(f"    - {q.question}" for q in have)
+        return parse_questions(await llm_pipeline.generate(prompt, call_llm), topic, difficulty)
+
+    return await fill_missing(parse_questions(raw, topic, difficulty), count, more_questions)
+
+# Pre-generated, validated questions bucketed by topic and difficulty
+QUESTION_BANK_PATH = os.getenv("QUESTION_BANK_PATH", os.path.join(current_directory, "question_bank.sqlite3"))
+question_bank = LazyResource("question bank", lambda: QuestionBank(QUESTION_BANK_PATH, embed=embed_texts))
+refill_worker: Optional[RefillWorker] = None
+
+async def start_refill_worker():
+    global refill_worker
+    bank = await question_bank.aget()
+    for level in range(10):
+        await run_embedding(bank.register, GAME_TOPIC, level, True)
+    refill_worker = RefillWorker(bank, generate_bank_questions, run_embedding)
+    refill_worker.start()
+
+def clamp_difficulty(difficulty: int) -> int:
+    return max(0, min(9, difficulty))
+
+async def take_questions(topic: str, difficulty: int, count: int, user_id: Optional[str]):
+    bank = await question_bank.aget()
+    difficulty = clamp_difficulty(difficulty)
+    await run_embedding(bank.register, topic, difficulty)
+    questions = await run_embedding(bank.sample, topic, difficulty, count, user_id, (), False)
+    if len(questions) < count:
+        # Bank can't cover this request yet: generate the shortfall now and let the worker catch up
+        generated = await generate_bank_questions(topic, difficulty, count - len(questions) + 2)
+        await run_embedding(bank.add, generated)
+        picked = {question["id"] for question in questions}
+        questions += await run_embedding(bank.sample, topic, difficulty, count - len(questions), user_id, picked, False)
+        if refill_worker is not None:
+            refill_worker.trigger()
+    if len(questions) < count:
+        # A short quiz is not what was asked for; nothing is added to the user's history either
+        raise HTTPException(status_code=503, detail=f"Only {len(questions)} of {count} questions are available right now; try again shortly")
+    await run_embedding(bank.mark_served, user_id, [question["id"] for question in questions])
+    return questions
+
+@router.post("/generate_quiz", response_model=QuizResponse)
+async def generate_quiz_route(request: QuizRequest) -> QuizResponse:
+    questions = await take_questions(request.topic, request.difficulty, request.num_questions, request.userId)
+    return QuizResponse(topic=normalize_topic(request.topic), difficulty=clamp_difficulty(request.difficulty), questions=questions)
+
+@router.post("/generate_quiz/stream")
+async def generate_quiz_stream(request: QuizRequest):
+    # Same questions as /generate_quiz, one NDJSON event each; taken before streaming so a shortfall is still a 503
+    questions = await take_questions(request.topic, request.difficulty, request.num_questions, request.userId)
+
+    def events() -> Iterator[str]:
+        for question in questions:
+            yield ndjson_event(type="question", question=question)
+        yield ndjson_event(type="done", topic=normalize_topic(request.topic), difficulty=clamp_difficulty(request.difficulty))
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.post("/generate_game", response_model=QuizResponse)
+async def generate_game(request: GameRequest) -> QuizResponse:
+    questions = await take_questions(GAME_TOPIC, request.level, request.num_questions, request.userId)
+    return QuizResponse(topic=GAME_TOPIC, difficulty=clamp_difficulty(request.level), questions=questions)
+
+async def build_chat_prompt(request: ChatRequest) -> str:
+    relevant_content = await retrieve_context(request.question, "chat", k=request.k)
+    return f"""
     You are a knowledgeable assistant. Based on the following information, answer the question:
 
     Question: {request.question}
 
     Relevant content:
-    {'\n\n'.join(relevant_contents)}
+    {relevant_content}
 
     Provide a clear and concise answer, referencing the relevant content where applicable.
     """
-    answer = call_gemini_api(prompt)
+
+@router.post("/chat")
+async def chat(request: ChatRequest):
+    answer = await cached_generate(f"chat:k={request.k}", request.question, lambda: build_chat_prompt(request))
     return {"question": request.question, "answer": answer}
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    return StreamingResponse(stream_llm_events(lambda: build_chat_prompt(request)), media_type="application/x-ndjson")
+
+# Long-running generation as durable background jobs: submit returns at once and the
+# client polls for progress, so a dropped connection or restart doesn't lose the work
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(current_directory, "jobs.sqlite3"))
+job_store = LazyResource("job store", lambda: JobStore(JOB_DB_PATH))
+job_worker: Optional[JobWorker] = None
+
+async def lesson_job(payload: dict, progress: dict, report_progress) -> dict:
+    request = LessonRequest(**payload)
+    if "subtopics" not in progress:
+        subtopics = (await generate_subtopics(SubtopicsRequest(topic=request.topic, age=request.age)))["subtopics"]
+        await report_progress({"subtopics": subtopics, "sections": [None] * len(subtopics), "completed": 0, "total": len(subtopics)})
+    subtopics, sections = progress["subtopics"], progress["sections"]
+
+    # Sections saved by an earlier attempt are reused
+    async def section(item):
+        i, subtopic = item
+        if sections[i] is None:
+            sections[i] = await generate_lesson_section(subtopic, request.topic, request.age)
+            await report_progress({"completed": sum(s is not None for s in sections)})
+        return sections[i]
+
+    full_lesson = await llm_pipeline.map(section, list(enumerate(subtopics)))
+    return {"subtopics": subtopics, "complete_lesson": "\n\n".join(full_lesson)}
+
+async def quiz_job(payload: dict, progress: dict, report_progress) -> dict:
+    return (await generate_quiz_route(QuizRequest(**payload))).model_dump()
+
+JOB_HANDLERS = {"lesson": lesson_job, "quiz": quiz_job}
+
+async def start_job_worker(concurrency: int = JOB_WORKERS) -> JobWorker:
+    global job_worker
+    job_worker = JobWorker(await job_store.aget(), JOB_HANDLERS, run_db, concurrency)
+    job_worker.start()
+    return job_worker
+
+def job_status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+async def submit_job(kind: str, payload: dict, idempotency_key: Optional[str], response: Response) -> dict:
+    store = await job_store.aget()
+    job, created = await run_db(store.submit, kind, payload, f"{kind}:{idempotency_key}" if idempotency_key else None)
+    if created and job_worker is not None:
+        job_worker.trigger()
+    # 202 for new work; 200 when an earlier submission with the same key is reused
+    response.status_code = 202 if created else 200
+    return {**job_status(job), "created": created, "status_url": f"/jobs/{job['id']}", "result_url": f"/jobs/{job['id']}/result"}
+
+@router.post("/jobs/lesson", status_code=202)
+async def submit_lesson_job(request: LessonRequest, response: Response, idempotency_key: Optional[str] = Header(None)):
+    # Without an Idempotency-Key header, the same topic and age share one job
+    key = idempotency_key or f"{normalize_topic(request.topic)}:{request.age}"
+    return await submit_job("lesson", request.model_dump(), key, response)
+
+@router.post("/jobs/quiz", status_code=202)
+async def submit_quiz_job(request: QuizRequest, response: Response, idempotency_key: Optional[str] = Header(None)):
+    # Quizzes are sampled fresh for each submission unless the client sends a key
+    return await submit_job("quiz", request.model_dump(), idempotency_key, response)
+
+async def find_job(job_id: str) -> dict:
+    store = await job_store.aget()
+    job = await run_db(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_status(await find_job(job_id))
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await find_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error']}")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job["result"]
+
+async def warm_up():
+    # Load in dependency order so /readyz flips as soon as RAG routes can be served
+    for resource in (sentence_model, corpus, retriever, recommender):
+        try:
+            await resource.aget()
+        except Exception:
+            logger.exception("Failed to load %s; it will be retried on first use", resource.name)
+            return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_task = asyncio.create_task(warm_up()) if WARM_UP else None
+    if JOB_WORKERS > 0:
+        await start_job_worker()
+    # Independent of warm-up: the worker only needs the bank, and it loads models on first use
+    try:
+        await start_refill_worker()
+    except Exception:
+        logger.exception("Failed to start the question bank refill worker")
+    yield
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if refill_worker is not None:
+        await refill_worker.stop()
+    if job_worker is not None:
+        await job_worker.stop()
+    await retrieval_batcher.stop()
+    # The executor pools are module-wide and shared by every app instance, so they are
+    # left running here; the process shuts them down when it exits
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+
+    # CORS configuration
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000"],  # Your React app's URL
+        allow_credentials=True,
+        allow_methods=["*"],  # Allow all methods (GET, POST, etc.)
+        allow_headers=["*"],  # Allow all headers
+    )
+    app.include_router(router)
+    instrumentation.install(app)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
+    shutdown_executors(wait=False)
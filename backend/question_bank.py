@@ -0,0 +1,388 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Collection, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from structured_output import extract_json, validate_items
+
+logger = logging.getLogger(__name__)
+
+# Bank settings, overridable from .env
+QUESTION_BANK_LOW_WATER = int(os.getenv("QUESTION_BANK_LOW_WATER", "20"))
+QUESTION_BANK_REFILL_BATCH = int(os.getenv("QUESTION_BANK_REFILL_BATCH", "10"))
+QUESTION_BANK_REFILL_INTERVAL = float(os.getenv("QUESTION_BANK_REFILL_INTERVAL", "30"))
+QUESTION_BANK_SIMILARITY = float(os.getenv("QUESTION_BANK_SIMILARITY", "0.9"))
+QUESTION_BANK_USER_HISTORY = int(os.getenv("QUESTION_BANK_USER_HISTORY", "500"))
+# Background refills share the LLM pipeline with live requests, so only a couple run at once
+QUESTION_BANK_REFILL_CONCURRENCY = int(os.getenv("QUESTION_BANK_REFILL_CONCURRENCY", "2"))
+# A bucket claimed for refilling is left to that process until it finishes or the lease runs out
+QUESTION_BANK_REFILL_LEASE = float(os.getenv("QUESTION_BANK_REFILL_LEASE", "300"))
+# Client-chosen topics are only refilled while they keep being requested, and only this many
+QUESTION_BANK_BUCKET_TTL = float(os.getenv("QUESTION_BANK_BUCKET_TTL", "86400"))
+QUESTION_BANK_MAX_BUCKETS = int(os.getenv("QUESTION_BANK_MAX_BUCKETS", "200"))
+MAX_QUIZ_QUESTIONS = int(os.getenv("MAX_QUIZ_QUESTIONS", "20"))
+
+# Bucket used by /generate_game, which mixes finance concepts rather than following one topic
+GAME_TOPIC = "general finance"
+
+
+OPTION_LABEL = re.compile(r"^\(?[A-Da-d][).:]\s+")
+ANSWER_LETTER = re.compile(r"\(?([A-Da-d])[).:]?")
+
+
+# A question as the LLM writes it; also the response schema requested from Gemini, which
+# sees the docstring and field descriptions
+class GeneratedQuestion(BaseModel):
+    """A multiple-choice question with four distinct options."""
+
+    question: str
+    options: List[str] = Field(min_length=4, max_length=4)
+    correct: int = Field(description="0-based index of the correct option")
+
+    @model_validator(mode="before")
+    @classmethod
+    def repair_answer(cls, data):
+        # Common slips fixed locally instead of paying for another call: "B" or the option
+        # text as the answer, and options labelled "A) ..."
+        if not isinstance(data, dict):
+            return data
+        options, correct = data.get("options"), data.get("correct")
+        if isinstance(options, list) and all(isinstance(o, str) for o in options) and all(OPTION_LABEL.match(o) for o in options):
+            options = [OPTION_LABEL.sub("", o) for o in options]
+        if isinstance(correct, str) and isinstance(options, list):
+            answer = correct.strip()
+            letter = ANSWER_LETTER.fullmatch(answer)
+            if letter:
+                correct = ord(letter.group(1).upper()) - ord("A")
+            else:
+                text = OPTION_LABEL.sub("", answer).lower()
+                correct = next((i for i, o in enumerate(options) if isinstance(o, str) and o.strip().lower() == text), correct)
+        return {**data, "options": options, "correct": correct}
+
+    @field_validator("question")
+    @classmethod
+    def question_not_empty(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("question is empty")
+        return value
+
+    @field_validator("options")
+    @classmethod
+    def four_distinct_options(cls, value: List[str]) -> List[str]:
+        value = [option.strip() for option in value]
+        if len(value) != 4 or not all(value) or len({option.lower() for option in value}) != 4:
+            raise ValueError("expected 4 distinct, non-empty options")
+        return value
+
+    @field_validator("correct")
+    @classmethod
+    def correct_in_range(cls, value: int) -> int:
+        if not 0 <= value < 4:
+            raise ValueError("correct must be an option index from 0 to 3")
+        return value
+
+
+class Question(GeneratedQuestion):
+    topic: str
+    difficulty: int
+
+    @field_validator("difficulty")
+    @classmethod
+    def difficulty_in_range(cls, value: int) -> int:
+        if not 0 <= value <= 9:
+            raise ValueError("difficulty must be between 0 and 9")
+        return value
+
+
+def normalize_topic(topic: str) -> str:
+    return re.sub(r"\s+", " ", topic).strip().lower()
+
+
+def parse_questions(raw: str, topic: str, difficulty: int) -> List[Question]:
+    """Parse a JSON array of questions from an LLM reply, keeping only the items that validate."""
+    try:
+        items = extract_json(raw)
+    except ValueError:
+        return []
+    questions, rejected = validate_items(items, Question, topic=normalize_topic(topic), difficulty=difficulty)
+    if rejected:
+        logger.info("Dropped %d malformed generated questions for %s/%d", rejected, topic, difficulty)
+    return questions
+
+
+class QuestionBank:
+    """
+    SQLite-backed store of validated questions bucketed by (topic, difficulty). New
+    questions that are near-duplicates of ones already in their bucket are rejected,
+    and sampling for a user skips questions similar to anything they were served before.
+    Several processes can share the file; each bucket is refilled by one of them at a time.
+    """
+
+    def __init__(self, path: str, embed: Callable[[List[str]], np.ndarray], similarity: float = QUESTION_BANK_SIMILARITY):
+        self.embed = embed
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # Readers don't block the writer, so every worker process can use the same bank
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                topic TEXT NOT NULL,
+                difficulty INTEGER NOT NULL,
+                question TEXT NOT NULL,
+                options TEXT NOT NULL,
+                correct INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS questions_bucket ON questions (topic, difficulty);
+            CREATE TABLE IF NOT EXISTS served (
+                user_id TEXT NOT NULL,
+                question_id INTEGER NOT NULL,
+                served_at REAL NOT NULL,
+                PRIMARY KEY (user_id, question_id)
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                topic TEXT NOT NULL,
+                difficulty INTEGER NOT NULL,
+                PRIMARY KEY (topic, difficulty)
+            );
+        """)
+        # Banks created before buckets could expire lack these columns
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(buckets)")}
+        if "last_requested" not in columns:
+            self._db.execute("ALTER TABLE buckets ADD COLUMN last_requested REAL NOT NULL DEFAULT 0")
+        if "pinned" not in columns:
+            self._db.execute("ALTER TABLE buckets ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        if "lease_until" not in columns:
+            self._db.execute("ALTER TABLE buckets ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+        self._db.commit()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embed(texts), dtype="float32")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def register(self, topic: str, difficulty: int, pinned: bool = False):
+        # Pinned buckets are always kept above the low-water mark; others only while recently requested
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO buckets (topic, difficulty, last_requested, pinned) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (topic, difficulty) DO UPDATE SET last_requested = excluded.last_requested, "
+                "pinned = MAX(pinned, excluded.pinned)",
+                (normalize_topic(topic), difficulty, time.time(), int(pinned)),
+            )
+            self._db.commit()
+
+    def prune_buckets(self, ttl: float = QUESTION_BANK_BUCKET_TTL, max_buckets: int = QUESTION_BANK_MAX_BUCKETS) -> int:
+        # Idle client topics stop being refilled; their questions stay available on demand
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM buckets WHERE pinned = 0 AND last_requested < ?", (time.time() - ttl,)
+            ).rowcount
+            removed += self._db.execute("""
+                DELETE FROM buckets WHERE pinned = 0 AND rowid NOT IN (
+                    SELECT rowid FROM buckets WHERE pinned = 0 ORDER BY last_requested DESC LIMIT ?
+                )
+            """, (max_buckets,)).rowcount
+            self._db.commit()
+        return removed
+
+    def count(self, topic: str, difficulty: int) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) FROM questions WHERE topic = ? AND difficulty = ?", (normalize_topic(topic), difficulty)
+            ).fetchone()
+        return row[0]
+
+    def claim_buckets_below(self, low_water: int = QUESTION_BANK_LOW_WATER, lease_seconds: float = QUESTION_BANK_REFILL_LEASE) -> List[Tuple[str, int]]:
+        """Leases the buckets below the low-water mark that no other process is refilling."""
+        now = time.time()
+        with self._lock:
+            # Write lock across processes, so two workers never claim the same bucket
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("""
+                    SELECT b.topic, b.difficulty FROM buckets b
+                    LEFT JOIN questions q ON q.topic = b.topic AND q.difficulty = b.difficulty
+                    WHERE b.lease_until < ?
+                    GROUP BY b.topic, b.difficulty
+                    HAVING COUNT(q.id) < ?
+                """, (now, low_water)).fetchall()
+                self._db.executemany(
+                    "UPDATE buckets SET lease_until = ? WHERE topic = ? AND difficulty = ?",
+                    [(now + lease_seconds, topic, difficulty) for topic, difficulty in rows],
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return [(topic, difficulty) for topic, difficulty in rows]
+
+    def release_bucket(self, topic: str, difficulty: int):
+        with self._lock:
+            self._db.execute("UPDATE buckets SET lease_until = 0 WHERE topic = ? AND difficulty = ?", (topic, difficulty))
+            self._db.commit()
+
+    def _bucket(self, topic: str, difficulty: int):
+        rows = self._db.execute(
+            "SELECT id, question, options, correct, embedding FROM questions WHERE topic = ? AND difficulty = ?",
+            (topic, difficulty),
+        ).fetchall()
+        vectors = np.stack([np.frombuffer(row[4], dtype="float32") for row in rows]) if rows else None
+        return rows, vectors
+
+    def add(self, questions: List[Question]) -> int:
+        if not questions:
+            return 0
+        vectors = self._embed([q.question + " " + " ".join(q.options) for q in questions])
+        added = 0
+        with self._lock:
+            for question, vector in zip(questions, vectors):
+                _, existing = self._bucket(question.topic, question.difficulty)
+                if existing is not None and float(np.max(existing @ vector)) >= self.similarity:
+                    continue
+                self._db.execute(
+                    "INSERT INTO questions (topic, difficulty, question, options, correct, embedding, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (question.topic, question.difficulty, question.question, json.dumps(question.options),
+                     question.correct, vector.astype("float32").tobytes(), time.time()),
+                )
+                added += 1
+            self._db.commit()
+        return added
+
+    def mark_served(self, user_id: Optional[str], question_ids: Collection[int]):
+        if not user_id or not question_ids:
+            return
+        with self._lock:
+            self._record_served(user_id, question_ids)
+
+    def _record_served(self, user_id: str, question_ids: Collection[int]):
+        now = time.time()
+        self._db.executemany("INSERT OR REPLACE INTO served VALUES (?, ?, ?)", [(user_id, i, now) for i in question_ids])
+        self._db.commit()
+
+    def sample(
+        self,
+        topic: str,
+        difficulty: int,
+        n: int,
+        user_id: Optional[str] = None,
+        exclude: Collection[int] = (),
+        record: bool = True,
+    ) -> List[dict]:
+        # exclude: ids already picked for the same quiz by an earlier call. With record=False the
+        # picks aren't added to the user's history; the caller does it with mark_served once it uses them
+        topic = normalize_topic(topic)
+        with self._lock:
+            rows, vectors = self._bucket(topic, difficulty)
+            if not rows:
+                return []
+            history = None
+            served_ids = set(exclude)
+            if user_id:
+                served = self._db.execute("""
+                    SELECT q.id, q.embedding FROM served s JOIN questions q ON q.id = s.question_id
+                    WHERE s.user_id = ? ORDER BY s.served_at DESC LIMIT ?
+                """, (user_id, QUESTION_BANK_USER_HISTORY)).fetchall()
+                served_ids |= {row[0] for row in served}
+                if served:
+                    history = np.stack([np.frombuffer(row[1], dtype="float32") for row in served])
+
+            picked = []
+            picked_vectors = []
+            for i in random.sample(range(len(rows)), len(rows)):
+                if len(picked) == n:
+                    break
+                if rows[i][0] in served_ids:
+                    continue
+                vector = vectors[i]
+                # Skip anything too close to what this user has already seen or to this quiz's picks
+                if history is not None and float(np.max(history @ vector)) >= self.similarity:
+                    continue
+                if picked_vectors and float(np.max(np.stack(picked_vectors) @ vector)) >= self.similarity:
+                    continue
+                picked.append(rows[i])
+                picked_vectors.append(vector)
+
+            if record and user_id and picked:
+                self._record_served(user_id, [row[0] for row in picked])
+        return [
+            {"id": row[0], "question": row[1], "options": json.loads(row[2]), "correct": row[3], "topic": topic, "difficulty": difficulty}
+            for row in picked
+        ]
+
+
+class RefillWorker:
+    """Background task that tops up registered buckets that fell below the low-water mark."""
+
+    def __init__(
+        self,
+        bank: QuestionBank,
+        generate: Callable[[str, int, int], Awaitable[List[Question]]],
+        run_blocking: Callable[..., Awaitable],
+        interval: float = QUESTION_BANK_REFILL_INTERVAL,
+        batch_size: int = QUESTION_BANK_REFILL_BATCH,
+        low_water: int = QUESTION_BANK_LOW_WATER,
+        concurrency: int = QUESTION_BANK_REFILL_CONCURRENCY,
+    ):
+        self.bank = bank
+        self.generate = generate
+        self.run_blocking = run_blocking
+        self.interval = interval
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def trigger(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def refill(self, topic: str, difficulty: int):
+        try:
+            async with self._semaphore:
+                questions = await self.generate(topic, difficulty, self.batch_size)
+                return await self.run_blocking(self.bank.add, questions)
+        finally:
+            await asyncio.shield(self.run_blocking(self.bank.release_bucket, topic, difficulty))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_blocking(self.bank.prune_buckets)
+                buckets = await self.run_blocking(self.bank.claim_buckets_below, self.low_water)
+                await asyncio.gather(*(self.refill(topic, difficulty) for topic, difficulty in buckets))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Question bank refill failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
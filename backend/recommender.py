@@ -0,0 +1,131 @@
+import os
+import re
+from typing import Callable, List, NamedTuple
+
+import numpy as np
+
+RECOMMEND_TOP_N = int(os.getenv("RECOMMEND_TOP_N", "3"))
+RECOMMEND_FAST_PATH = os.getenv("RECOMMEND_FAST_PATH", "true").lower() == "true"
+
+CD_MIN_DEPOSIT = 2500
+PLATINUM_FEE_WAIVER_BALANCE = 3500
+GOOD_CREDIT = 670
+FAIR_CREDIT = 580
+
+# Eligibility rules and score adjustments per service, keyed by service name.
+#   min_age / max_age / min_credit_score: hard eligibility limits
+#   min_savings: amount the user should be able to set aside within a year
+#   young_bonus: boost for users under 24 (fee waivers)
+RULES = {
+    "Wells Fargo Way2Save Savings Account": {"young_bonus": 0.15},
+    "Wells Fargo Platinum Savings Account": {"min_age": 18, "min_savings": PLATINUM_FEE_WAIVER_BALANCE},
+    "Wells Fargo Certificates of Deposit (CDs)": {"min_age": 18, "min_savings": CD_MIN_DEPOSIT},
+    "Wells Fargo Kids Savings Account": {"max_age": 17, "minor_bonus": 0.3},
+    "Wells Fargo Cashback Credit Cards": {"min_age": 18, "min_credit_score": FAIR_CREDIT},
+    "Wells Fargo Rewards Credit Cards": {"min_age": 18, "min_credit_score": GOOD_CREDIT},
+    "Wells Fargo 0% Intro APR Credit Cards": {"min_age": 18, "min_credit_score": GOOD_CREDIT, "debt_bonus": 0.1},
+    "Wells Fargo Travel Credit Cards": {"min_age": 18, "min_credit_score": GOOD_CREDIT},
+    "Wells Fargo Balance Transfer Credit Cards": {"min_age": 18, "min_credit_score": GOOD_CREDIT, "debt_bonus": 0.15},
+    "Wells Fargo Business Credit Cards": {"min_age": 18, "min_credit_score": GOOD_CREDIT, "business": True},
+    "Wells Fargo Home Loan Products": {"min_age": 18, "min_credit_score": FAIR_CREDIT},
+    "Wells Fargo Personal Loans": {"min_age": 18, "min_credit_score": 660},
+}
+
+BUSINESS_WORDS = re.compile(r"business|owner|founder|entrepreneur|self[- ]employed|freelanc|contractor", re.I)
+
+
+class RankedService(NamedTuple):
+    service: dict
+    score: float
+    reasons: List[str]
+
+
+class ServiceRecommender:
+    """
+    Shortlists Wells Fargo services for a profile before any LLM call: service descriptions
+    are embedded once, each request is scored by similarity to a short profile description,
+    and rule-based eligibility removes or adjusts services (kids' accounts for minors,
+    credit score floors, the CD minimum deposit, ...).
+    """
+
+    def __init__(self, services: List[dict], embed: Callable[[List[str]], np.ndarray]):
+        self.services = services
+        self.embed = embed
+        self.vectors = np.asarray(embed([f"{s['name']}. {s['description']}" for s in services]), dtype="float32")
+
+    @staticmethod
+    def profile_text(request) -> str:
+        surplus = request.monthly_income - request.monthly_expenses
+        parts = [f"A {request.age} year old {request.occupation} in {request.country}"]
+        parts.append(f"with a credit score of {request.credit_score}")
+        if surplus > 0:
+            parts.append(f"who can save about {surplus:.0f} per month")
+        else:
+            parts.append("whose expenses exceed their income and who may carry debt")
+        if request.age < 18:
+            parts.append("looking for a first savings account for a minor")
+        return ", ".join(parts) + "."
+
+    @staticmethod
+    def check(service: dict, request) -> RankedService:
+        rule = RULES.get(service["name"], {})
+        surplus = request.monthly_income - request.monthly_expenses
+        reasons = []
+        if "min_age" in rule and request.age < rule["min_age"]:
+            return RankedService(service, float("-inf"), [f"requires age {rule['min_age']}+"])
+        if "max_age" in rule and request.age > rule["max_age"]:
+            return RankedService(service, float("-inf"), [f"only for ages up to {rule['max_age']}"])
+        if "min_credit_score" in rule and request.credit_score < rule["min_credit_score"]:
+            return RankedService(service, float("-inf"), [f"typically needs a credit score of {rule['min_credit_score']}+"])
+        if "min_savings" in rule and surplus * 12 < rule["min_savings"]:
+            return RankedService(service, float("-inf"), [f"needs about ${rule['min_savings']:,} to open or avoid fees"])
+
+        bonus = 0.0
+        if rule.get("young_bonus") and request.age < 24:
+            bonus += rule["young_bonus"]
+            reasons.append("fees are waived for customers under 24")
+        if rule.get("minor_bonus") and request.age < 18:
+            bonus += rule["minor_bonus"]
+            reasons.append("designed for savers under 18")
+        if rule.get("debt_bonus") and surplus <= 0:
+            bonus += rule["debt_bonus"]
+            reasons.append("a 0% intro APR helps pay down existing balances")
+        if rule.get("business"):
+            if BUSINESS_WORDS.search(request.occupation):
+                bonus += 0.2
+                reasons.append("built for business spending")
+            else:
+                bonus -= 0.2
+        if "min_savings" in rule:
+            reasons.append(f"your monthly surplus covers the ${rule['min_savings']:,} minimum within a year")
+        if "min_credit_score" in rule:
+            reasons.append(f"your credit score of {request.credit_score} meets the usual requirement")
+        return RankedService(service, bonus, reasons)
+
+    def rank(self, request, top_n: int = RECOMMEND_TOP_N) -> List[RankedService]:
+        query = np.asarray(self.embed([self.profile_text(request)]), dtype="float32")[0]
+        similarities = self.vectors @ query
+        ranked = []
+        for service, similarity in zip(self.services, similarities):
+            checked = self.check(service, request)
+            if checked.score != float("-inf"):
+                ranked.append(checked._replace(score=float(similarity) + checked.score))
+        ranked.sort(key=lambda item: item.score, reverse=True)
+        return ranked[:top_n]
+
+    @staticmethod
+    def is_low_stakes(request, ranked: List[RankedService]) -> bool:
+        # Minors and profiles with at most one eligible product don't need a model to explain the choice
+        return RECOMMEND_FAST_PATH and (request.age < 18 or len(ranked) <= 1)
+
+    @staticmethod
+    def fast_recommendation(ranked: List[RankedService]) -> str:
+        if not ranked:
+            return "None of the available services fit this profile yet. Building savings and credit history first will open up more options."
+        lines = []
+        for i, item in enumerate(ranked):
+            summary = item.service["description"].split(". ")[0].rstrip(".") + "."
+            why = f" It fits because {'; '.join(item.reasons)}." if item.reasons else ""
+            lead = "We recommend" if i == 0 else "You could also consider"
+            lines.append(f"{lead} **{item.service['name']}**. {summary}{why}")
+        return "\n\n".join(lines)
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LazyResource(Generic[T]):
+    """
+    A heavy object (model, index, client) that is created on first use instead of at
+    import. Creation runs once even under concurrent callers; a failed attempt is
+    recorded for the readiness probe and retried on the next use.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self.factory = factory
+        self._value: Optional[T] = None
+        self._ready = False
+        self._loading = False
+        self._error: Optional[BaseException] = None
+        self._load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> T:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                self._loading = True
+                started = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except BaseException as e:
+                    self._error = e
+                    raise
+                finally:
+                    self._loading = False
+                self._load_seconds = time.perf_counter() - started
+                self._error = None
+                self._ready = True
+        return self._value
+
+    def set(self, value: T):
+        # Swap in a ready-made value, e.g. an offline fake for benchmarks
+        with self._lock:
+            self._value = value
+            self._error = None
+            self._ready = True
+
+    async def aget(self) -> T:
+        # Loading blocks for seconds, so it never runs on the event loop
+        if self._ready:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def status(self) -> Dict[str, object]:
+        status = {"ready": self._ready, "loading": self._loading}
+        if self._load_seconds is not None:
+            status["load_seconds"] = round(self._load_seconds, 3)
+        if self._error is not None:
+            status["error"] = repr(self._error)
+        return status
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# Cache settings, overridable from .env
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+
+def normalize_key(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class LocalSharedBackend:
+    """In-process stand-in for a shared cache such as Redis, with the same get/set contract."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = "llm-cache:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RESPONSE_CACHE_REDIS_URL is set but the 'redis' package is not installed") from e
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self._prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._client.set(self._prefix + key, value, ex=max(1, int(ttl)))
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "vector")
+
+    def __init__(self, value: str, expires_at: float, size: int, vector: Optional[np.ndarray]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.vector = vector
+
+
+class ResponseCache:
+    """
+    Two-level cache for LLM responses. Lookups first match the normalized key exactly,
+    then fall back to the most similar earlier query in the same namespace by cosine
+    similarity of its embedding. Entries expire after a TTL and are evicted LRU-first
+    once the entry count or memory cap is exceeded.
+    """
+
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], np.ndarray]] = None,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+        shared_backend=None,
+    ):
+        self.embed = embed
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self.shared_backend = shared_backend
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        # Per-namespace matrix of query embeddings, rebuilt lazily after changes
+        self._matrices: Dict[str, Tuple[list, np.ndarray]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "shared_hits": 0, "misses": 0}
+
+    @staticmethod
+    def _shared_key(namespace: str, key: str) -> str:
+        return hashlib.sha256(f"{namespace}\x00{key}".encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed(text), dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, namespace: str, text: str, semantic: bool = True) -> Optional[str]:
+        return self.lookup(namespace, text, semantic)[0]
+
+    def lookup(self, namespace: str, text: str, semantic: bool = True) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        # Also returns the key's embedding when one was computed, so set() after a miss doesn't encode it again
+        key = normalize_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end((namespace, key))
+                self.stats["exact_hits"] += 1
+                return entry.value, None
+            if entry is not None:
+                self._remove((namespace, key))
+
+        if self.shared_backend is not None:
+            raw = self.shared_backend.get(self._shared_key(namespace, key))
+            if raw is not None:
+                value = json.loads(raw)
+                self._store(namespace, key, value, None)
+                with self._lock:
+                    self.stats["shared_hits"] += 1
+                return value, None
+
+        vector = None
+        if semantic and self.embed is not None:
+            vector = self._embed(key)
+            with self._lock:
+                match = self._nearest(namespace, vector, now)
+                if match is not None:
+                    self._entries.move_to_end((namespace, match))
+                    self.stats["semantic_hits"] += 1
+                    return self._entries[(namespace, match)].value, vector
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, vector
+
+    def set(self, namespace: str, text: str, value: str, semantic: bool = True, vector: Optional[np.ndarray] = None):
+        # vector: the key's embedding from lookup(), if it already computed one
+        key = normalize_key(text)
+        if not semantic or self.embed is None:
+            vector = None
+        elif vector is None:
+            vector = self._embed(key)
+        self._store(namespace, key, value, vector)
+        if self.shared_backend is not None:
+            self.shared_backend.set(self._shared_key(namespace, key), json.dumps(value).encode("utf-8"), self.ttl)
+
+    def _store(self, namespace: str, key: str, value: str, vector: Optional[np.ndarray]):
+        size = len(key) + len(value.encode("utf-8")) + (vector.nbytes if vector is not None else 0)
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._remove((namespace, key))
+            self._entries[(namespace, key)] = _Entry(value, time.time() + self.ttl, size, vector)
+            self._bytes += size
+            if vector is not None:
+                self._matrices.pop(namespace, None)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_key: Tuple[str, str]):
+        entry = self._entries.pop(entry_key)
+        self._bytes -= entry.size
+        if entry.vector is not None:
+            self._matrices.pop(entry_key[0], None)
+
+    def _nearest(self, namespace: str, vector: np.ndarray, now: float) -> Optional[str]:
+        if namespace not in self._matrices:
+            keys = [k for (ns, k), e in self._entries.items() if ns == namespace and e.vector is not None]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[(namespace, k)].vector for k in keys])
+            self._matrices[namespace] = (keys, matrix)
+        keys, matrix = self._matrices[namespace]
+        if not keys:
+            return None
+        scores = matrix @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < self.similarity_threshold:
+                return None
+            entry = self._entries.get((namespace, keys[i]))
+            if entry is not None and entry.expires_at > now:
+                return keys[i]
+        return None
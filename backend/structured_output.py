@@ -0,0 +1,103 @@
+import functools
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, List, Tuple, TypeVar
+
+from pydantic import TypeAdapter, ValidationError
+
+T = TypeVar("T")
+
+# Ask Gemini for schema-constrained JSON; when off, prompts still ask for JSON and parsing is the same
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "true").lower() == "true"
+# Extra LLM calls allowed to replace items that failed validation
+STRUCTURED_REPAIR_ATTEMPTS = int(os.getenv("STRUCTURED_REPAIR_ATTEMPTS", "1"))
+
+# The OpenAPI subset Gemini's response_schema accepts
+SCHEMA_KEYS = {"type", "format", "description", "nullable", "enum", "required"}
+RENAMED_KEYS = {"minItems": "min_items", "maxItems": "max_items"}
+
+CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+
+def gemini_schema(output_type) -> dict:
+    """JSON schema of a Pydantic model or type, reduced to what Gemini accepts as response_schema."""
+    schema = TypeAdapter(output_type).json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def convert(node: dict) -> dict:
+        if "$ref" in node:
+            node = definitions[node["$ref"].rsplit("/", 1)[-1]]
+        out = {}
+        for key, value in node.items():
+            if key == "properties":
+                out[key] = {name: convert(child) for name, child in value.items()}
+            elif key == "items":
+                out[key] = convert(value)
+            elif key in RENAMED_KEYS:
+                out[RENAMED_KEYS[key]] = value
+            elif key in SCHEMA_KEYS:
+                out[key] = value
+        return out
+
+    return convert(schema)
+
+
+@functools.lru_cache(maxsize=None)
+def json_output_config(output_type) -> dict:
+    # Built once per output type; callers must not modify the returned dict
+    return {"response_mime_type": "application/json", "response_schema": gemini_schema(output_type)}
+
+
+def extract_json(raw: str) -> Any:
+    """Parse the JSON in an LLM reply, tolerating code fences, surrounding prose and trailing commas."""
+    text = CODE_FENCE.sub("", raw.strip())
+    candidates = [text]
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    if starts:
+        candidates.append(text[min(starts):max(text.rfind("]"), text.rfind("}")) + 1])
+    for candidate in candidates:
+        for attempt in (candidate, TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                return json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+    raise ValueError("no JSON found in the reply")
+
+
+def as_list(value: Any) -> list:
+    # Models sometimes wrap the requested array in an object, e.g. {"questions": [...]}
+    if isinstance(value, dict):
+        lists = [v for v in value.values() if isinstance(v, list)]
+        return lists[0] if len(lists) == 1 else []
+    return value if isinstance(value, list) else []
+
+
+def validate_items(items: Any, item_type, **fields) -> Tuple[list, int]:
+    """
+    Validate each element on its own, so one malformed item doesn't throw away the
+    rest. `fields` are merged into object items. Returns (valid items, rejected count).
+    """
+    adapter = TypeAdapter(item_type)
+    valid, rejected = [], 0
+    for item in as_list(items):
+        try:
+            valid.append(adapter.validate_python({**item, **fields} if isinstance(item, dict) and fields else item))
+        except (ValidationError, TypeError):
+            rejected += 1
+    return valid, rejected
+
+
+async def fill_missing(
+    items: List[T],
+    wanted: int,
+    generate_more: Callable[[List[T], int], Awaitable[List[T]]],
+    attempts: int = STRUCTURED_REPAIR_ATTEMPTS,
+) -> List[T]:
+    # Only the shortfall is requested again; items that already validated are kept as they are
+    for _ in range(attempts):
+        if len(items) >= wanted:
+            break
+        items = items + await generate_more(items, wanted - len(items))
+    return items[:wanted]
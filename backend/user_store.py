@@ -0,0 +1,188 @@
+import copy
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from instrumentation import count_cache, span
+
+# "firestore" talks to Firestore (or the emulator when FIRESTORE_EMULATOR_HOST is set);
+# "memory" keeps users in-process so the API can be load-tested without any network
+USER_STORE_BACKEND = os.getenv("USER_STORE_BACKEND", "firestore").lower()
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+# Never kept in the profile cache; reads asking for them always go to the backend
+UNCACHED_FIELDS = frozenset({"password"})
+
+USERS_COLLECTION = "users"
+
+
+class FirestoreUserBackend:
+    def __init__(self, db, collection: str = USERS_COLLECTION):
+        from google.api_core.exceptions import NotFound
+
+        self._collection = db.collection(collection)
+        self._not_found = NotFound
+
+    def create(self, data: dict) -> str:
+        doc_ref = self._collection.document()
+        doc_ref.set(data)
+        return doc_ref.id
+
+    def get(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        # A projection only transfers the requested fields
+        doc = self._collection.document(user_id).get(field_paths=fields)
+        return (doc.to_dict() or {}) if doc.exists else None
+
+    def update(self, user_id: str, data: dict) -> bool:
+        # update() carries an exists precondition, so the existence check and the write
+        # are one atomic round-trip instead of a get() followed by an update()
+        try:
+            self._collection.document(user_id).update(data)
+        except self._not_found:
+            return False
+        return True
+
+
+class MemoryUserBackend:
+    """In-process backend with the same contract as FirestoreUserBackend."""
+
+    def __init__(self, latency: Union[float, Callable[[], float]] = 0.0):
+        # latency is seconds per round-trip, or a callable sampling it (see bench_fakes.Latency)
+        self.latency = latency
+        self._docs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+
+    def create(self, data: dict) -> str:
+        self._round_trip()
+        user_id = uuid.uuid4().hex[:20]
+        with self._lock:
+            self._docs[user_id] = copy.deepcopy(data)
+        return user_id
+
+    def get(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        self._round_trip()
+        with self._lock:
+            doc = self._docs.get(user_id)
+            if doc is None:
+                return None
+            if fields is not None:
+                return {field: copy.deepcopy(doc[field]) for field in fields if field in doc}
+            return copy.deepcopy(doc)
+
+    def update(self, user_id: str, data: dict) -> bool:
+        self._round_trip()
+        with self._lock:
+            if user_id not in self._docs:
+                return False
+            self._docs[user_id].update(copy.deepcopy(data))
+        return True
+
+
+class UserStore:
+    """
+    Repository for user profiles with a read-through cache in front of the backend.
+    Full profiles and field projections are cached on first read (a projection only
+    answers later reads for the fields it fetched), except fields in UNCACHED_FIELDS,
+    and every write through the store drops the cached copy so the next read sees it. The TTL bounds staleness from
+    writes made by other instances.
+    """
+
+    def __init__(self, backend, ttl: float = PROFILE_CACHE_TTL, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user_id -> (profile, fields fetched or None for the whole document, expires_at)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        # Bumped on every write so a read that raced with the write doesn't re-cache old data
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _cached(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        with self._lock:
+            item = self._cache.get(user_id)
+            if item is not None and item[2] <= time.time():
+                del self._cache[user_id]
+                item = None
+            if item is None or (item[1] is not None and (fields is None or not item[1].issuperset(fields))):
+                self.stats["misses"] += 1
+                count_cache("profile", hit=False)
+                return None
+            self._cache.move_to_end(user_id)
+            self.stats["hits"] += 1
+            count_cache("profile", hit=True)
+            profile = item[0]
+            if fields is not None:
+                return {field: copy.deepcopy(profile[field]) for field in fields if field in profile}
+            return copy.deepcopy(profile)
+
+    def _remember(self, user_id: str, profile: dict, fields: Optional[List[str]], generation: int):
+        if self.ttl <= 0:
+            return
+        if UNCACHED_FIELDS.intersection(profile):
+            # What's left is cached as a projection, so reads of the whole document still hit the backend
+            profile = {field: value for field, value in profile.items() if field not in UNCACHED_FIELDS}
+            fields = list(profile) if fields is None else [field for field in fields if field not in UNCACHED_FIELDS]
+        with self._lock:
+            if generation != self._generation:
+                return
+            known = None
+            if fields is not None:
+                known = frozenset(fields)
+                item = self._cache.get(user_id)
+                if item is not None and item[2] > time.time():
+                    if item[1] is None:
+                        return
+                    profile = {**item[0], **profile}
+                    known = known | item[1]
+            self._cache[user_id] = (profile, known, time.time() + self.ttl)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                if self._cache.pop(user_id, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def create(self, data: dict) -> str:
+        # Not cached: the login doc holds the password, and the first read fetches the profile anyway
+        with span("db.create"):
+            return self.backend.create(data)
+
+    def get(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[dict]:
+        profile = self._cached(user_id, fields)
+        if profile is not None:
+            return profile
+        generation = self._generation
+        with span("db.get"):
+            profile = self.backend.get(user_id, fields)
+        if profile is None:
+            return None
+        self._remember(user_id, copy.deepcopy(profile), fields, generation)
+        return profile
+
+    def update(self, user_id: str, data: dict) -> bool:
+        try:
+            with span("db.update"):
+                return self.backend.update(user_id, data)
+        finally:
+            self.invalidate([user_id])
+
+
+def create_user_store(db=None, backend: str = USER_STORE_BACKEND) -> UserStore:
+    if backend == "memory":
+        return UserStore(MemoryUserBackend())
+    if backend == "firestore":
+        return UserStore(FirestoreUserBackend(db))
+    raise ValueError(f"Unknown USER_STORE_BACKEND {backend!r}; expected 'firestore' or 'memory'")